@@ -0,0 +1,203 @@
+"""Typed inline-button callback data and the router that dispatches on it.
+
+Buttons carry "<version>|<action>|<field>|...". Each action is a NamedTuple
+registered under a one-letter code; its annotations say how fields are
+packed and validated (int, bool, str, datetime or a Literal of choices).
+Data from another version, e.g. buttons on old messages after a format
+change, fails to unpack and the user is asked to reopen the menu.
+
+CallbackRouter keeps one handler per action in a dict, so a tap costs one
+decode and one lookup no matter how many actions exist.
+"""
+import logging
+from datetime import datetime
+from typing import Literal, NamedTuple, get_args, get_origin, get_type_hints
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import CallbackQuery
+
+logger = logging.getLogger(__name__)
+
+VERSION = '1'
+SEP = '|'
+
+# Telegram rejects callback_data longer than this
+MAX_BYTES = 64
+
+_actions = {}  # code -> payload class
+
+
+class CallbackDataError(ValueError):
+    pass
+
+
+def _field_codec(annotation):
+    """(pack, unpack) functions for one annotated field"""
+    if get_origin(annotation) is Literal:
+        choices = get_args(annotation)
+        pack, unpack = _field_codec(type(choices[0]))
+
+        def unpack_choice(raw):
+            value = unpack(raw)
+            if value not in choices:
+                raise CallbackDataError(f"{value!r} is not one of {choices}")
+            return value
+        return pack, unpack_choice
+    if annotation is bool:
+        def unpack_bool(raw):
+            if raw not in ('0', '1'):
+                raise CallbackDataError(f"{raw!r} is not a flag")
+            return raw == '1'
+        return (lambda value: '1' if value else '0'), unpack_bool
+    if annotation is int:
+        return str, int
+    if annotation is datetime:
+        return datetime.isoformat, datetime.fromisoformat
+    if annotation is str:
+        return str, str
+    raise TypeError(f"Unsupported callback field type {annotation!r}")
+
+
+def action(code: str):
+    """Register a NamedTuple as the payload of the callback action `code`"""
+    def register(cls):
+        if code in _actions or SEP in code:
+            raise ValueError(f"Callback action code {code!r} is taken or invalid")
+        cls.__action__ = code
+        cls.__codecs__ = [_field_codec(annotation) for annotation in get_type_hints(cls).values()]
+        cls.pack = pack
+        _actions[code] = cls
+        return cls
+    return register
+
+
+def pack(payload) -> str:
+    parts = [VERSION, payload.__action__]
+    for (pack_field, _), value in zip(payload.__codecs__, payload):
+        raw = pack_field(value)
+        if SEP in raw:
+            raise CallbackDataError(f"{SEP!r} not allowed in callback field {raw!r}")
+        parts.append(raw)
+
+    data = SEP.join(parts)
+    if len(data.encode()) > MAX_BYTES:
+        raise CallbackDataError(f"Callback data too long: {data!r}")
+    return data
+
+
+def unpack(data: str):
+    version, _, rest = data.partition(SEP)
+    if version != VERSION:
+        raise CallbackDataError(f"Unsupported callback data {data!r}")
+
+    code, *raw_fields = rest.split(SEP)
+    cls = _actions.get(code)
+    if cls is None or len(raw_fields) != len(cls.__codecs__):
+        raise CallbackDataError(f"Unknown callback data {data!r}")
+
+    try:
+        return cls(*(unpack_field(raw) for (_, unpack_field), raw in zip(cls.__codecs__, raw_fields)))
+    except CallbackDataError:
+        raise
+    except ValueError as e:
+        raise CallbackDataError(f"Malformed callback data {data!r}: {e}")
+
+
+@action('f')
+class SelectFrequency(NamedTuple):
+    frequency: Literal['weekly', 'monthly']
+
+
+@action('c')
+class ConfirmLoan(NamedTuple):
+    confirmed: bool
+
+
+@action('a')
+class AdjustPayments(NamedTuple):
+    loan_id: int
+    delta: Literal[-1, 1]
+
+
+@action('b')
+class BackToLoans(NamedTuple):
+    pass
+
+
+@action('v')
+class ViewLoan(NamedTuple):
+    loan_id: int
+
+
+@action('h')
+class LoanHistory(NamedTuple):
+    loan_id: int
+
+
+@action('p')
+class Page(NamedTuple):
+    page: int
+    direction: Literal['n', 'p']
+    created_at: datetime
+    loan_id: int
+
+
+@action('i')
+class PageInfo(NamedTuple):
+    pass
+
+
+@action('s')
+class SearchName(NamedTuple):
+    pass
+
+
+@action('x')
+class CancelSearch(NamedTuple):
+    pass
+
+
+class CallbackRouter:
+    """Dispatches callback queries to one handler per payload type.
+
+    Handlers get the decoded payload as `callback_data` plus the usual
+    aiogram keyword arguments (state, bot, ...) they ask for.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def on(self, payload_cls):
+        def register(handler):
+            if payload_cls in self._handlers:
+                raise ValueError(f"{payload_cls.__name__} already has a handler")
+            self._handlers[payload_cls] = CallableObject(handler)
+            return handler
+        return register
+
+    def handler_name(self, callback: CallbackQuery) -> str:
+        """Name of the handler a tap will reach, for metrics labels; reads only the action code"""
+        version, _, rest = (callback.data or '').partition(SEP)
+        cls = _actions.get(rest.split(SEP, 1)[0]) if version == VERSION else None
+        handler = self._handlers.get(cls)
+        return handler.callback.__name__ if handler else 'unknown'
+
+    def setup(self, router: Router):
+        router.callback_query.register(self.dispatch)
+
+    async def dispatch(self, callback: CallbackQuery, **data):
+        try:
+            payload = unpack(callback.data or '')
+        except CallbackDataError as e:
+            logger.debug("Rejected callback from %s: %s", callback.from_user.id, e)
+            await callback.answer("This button has expired. Please open the menu again.")
+            return
+
+        handler = self._handlers.get(type(payload))
+        if handler is None:
+            logger.warning("No handler for callback action %s", type(payload).__name__)
+            await callback.answer()
+            return
+
+        return await handler.call(callback, callback_data=payload, **data)
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TapCoalescer:
+    """Merges bursts of numeric taps per key into a single flush.
+
+    The first add() for a key opens a window of `window` seconds; when it
+    closes, flush(key, net_delta, context) runs once with the summed delta and
+    the latest context. Taps arriving during a flush open a new window, whose
+    flush waits for the previous one so results are applied in order.
+    """
+
+    def __init__(self, flush, window: float):
+        self.flush = flush
+        self.window = window
+        self._pending = {}  # key -> [net delta, context]
+        self._tasks = {}  # key -> task of the latest window
+
+    def add(self, key, delta: int, context=None) -> int:
+        """Record a tap and return the net delta pending for `key`"""
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = [0, None]
+            self._tasks[key] = asyncio.create_task(self._run(key, self._tasks.get(key)))
+
+        pending[0] += delta
+        pending[1] = context
+        return pending[0]
+
+    async def _run(self, key, previous):
+        await asyncio.sleep(self.window)
+        delta, context = self._pending.pop(key)
+        if previous is not None:
+            await previous
+
+        try:
+            await self.flush(key, delta, context)
+        except Exception as e:
+            logger.exception("Flushing coalesced taps for %s failed: %s", key, e)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
@@ -0,0 +1,107 @@
+import logging
+
+from sqlalchemy import select, func, insert
+from sqlalchemy.exc import DBAPIError
+
+from app.database.models import get_engine, Base, Person, Loan, FsmRecord, RateLimitBucket, Payment, SchemaVersion
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+# pg_advisory_xact_lock key serializing migrations across bot processes
+MIGRATION_LOCK_ID = 0x6c6f616e
+
+
+def migration(version: int, description: str):
+    """Register a schema migration step.
+
+    Steps receive a sync connection (via run_sync) and must be idempotent, so a
+    freshly created database that already has the latest tables from the
+    baseline step can still run them safely.
+    """
+    def decorator(step):
+        MIGRATIONS.append((version, description, step))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return step
+
+    return decorator
+
+
+def _create_extensions(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+@migration(1, "Baseline schema")
+def baseline(conn):
+    _create_extensions(conn)
+    Base.metadata.create_all(conn)
+
+
+@migration(2, "Indexes for active loans list, loan borrower join and name search")
+def hot_path_indexes(conn):
+    _create_extensions(conn)
+    for index in (*Person.__table__.indexes, *Loan.__table__.indexes):
+        index.create(conn, checkfirst=True)
+
+
+@migration(3, "FSM storage table")
+def fsm_storage(conn):
+    FsmRecord.__table__.create(conn, checkfirst=True)
+
+
+@migration(4, "Shared rate limit buckets")
+def rate_limit_buckets(conn):
+    RateLimitBucket.__table__.create(conn, checkfirst=True)
+
+
+@migration(5, "Payments ledger")
+def payments_ledger(conn):
+    Payment.__table__.create(conn, checkfirst=True)
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+async def current_version():
+    """Recorded schema version, or None when the version table doesn't exist yet."""
+    try:
+        async with get_engine().connect() as conn:
+            return await conn.scalar(select(func.max(SchemaVersion.version))) or 0
+    except DBAPIError:
+        return None
+
+
+async def upgrade():
+    """Bring the schema up to date, skipping all DDL when it already is.
+
+    Pending migrations run in a single transaction. On PostgreSQL it holds an
+    advisory lock so replicas starting together migrate one at a time; the
+    ones that waited re-read the version and find nothing left to do.
+    """
+    current = await current_version()
+    if current is not None and current >= latest_version():
+        if current > latest_version():
+            logger.warning("Database schema version %s is newer than this code (%s)", current, latest_version())
+        return current
+
+    async with get_engine().begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            await conn.execute(select(func.pg_advisory_xact_lock(MIGRATION_LOCK_ID)))
+
+        await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+        current = await conn.scalar(select(func.max(SchemaVersion.version))) or 0
+
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+
+            logger.info("Applying migration %s: %s", version, description)
+            await conn.run_sync(step)
+            await conn.execute(
+                insert(SchemaVersion).values(version=version, description=description)
+            )
+
+    return latest_version()
@@ -1,19 +1,152 @@
 import os
+from contextvars import ContextVar
 from dotenv import load_dotenv
 from datetime import datetime
 
-from sqlalchemy import BigInteger, String, Float, Integer, DateTime, ForeignKey, Boolean
+from sqlalchemy import event, BigInteger, String, Float, Integer, DateTime, ForeignKey, Boolean, Index, JSON, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs, AsyncEngine, AsyncSession
+
+from app.database import trigram
+from app.database.cache import TTLCache
+from app.database.pool import InstrumentedPool
 
 load_dotenv()
 
-database_url = os.getenv('DATABASE_URL')
-if database_url and database_url.startswith('postgres://'):
-    database_url = database_url.replace('postgres://', 'postgresql+asyncpg://', 1)
 
-engine = create_async_engine(database_url)
-async_session = async_sessionmaker(engine)
+def _normalize_url(url: str) -> str:
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql+asyncpg://', 1)
+    return url
+
+
+def database_url() -> str:
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        raise RuntimeError("DATABASE_URL is not set (use sqlite+aiosqlite:///:memory: for a throwaway database)")
+    return _normalize_url(url)
+
+
+def engine_options(url: str) -> dict:
+    """Pool and driver settings for create_async_engine, read from the environment."""
+    if url.startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': InstrumentedPool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', -1)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'false').lower() in ('1', 'true', 'yes'),
+    }
+
+    if url.startswith('postgresql+asyncpg'):
+        connect_args = {
+            'prepared_statement_cache_size': int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+        }
+        statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT')  # milliseconds
+        if statement_timeout:
+            connect_args['server_settings'] = {'statement_timeout': statement_timeout}
+        options['connect_args'] = connect_args
+
+    return options
+
+
+_engine = None
+_session_factory = None
+_read_engine = None
+_read_session_factory = None
+
+# Telegram user of the update being handled, set by app.middlewares.DatabaseRoutingMiddleware
+current_user = ContextVar('current_user', default=None)
+
+# Users who wrote recently; their reads stay on the primary until the replica has caught up
+recent_writers = TTLCache(
+    maxsize=int(os.getenv('READ_YOUR_WRITES_USERS', 1024)),
+    ttl=float(os.getenv('READ_YOUR_WRITES_WINDOW', 5))
+)
+
+
+def _create_engine(url: str, options: dict) -> AsyncEngine:
+    engine = create_async_engine(url, **{**engine_options(url), **options})
+
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine.sync_engine, 'connect')
+        def _register_sqlite_functions(dbapi_connection, connection_record):
+            # pg_trgm stand-ins so name search works on SQLite
+            dbapi_connection.create_function('similarity', 2, trigram.similarity, deterministic=True)
+            dbapi_connection.create_function('word_similarity', 2, trigram.word_similarity, deterministic=True)
+
+    return engine
+
+
+def configure(url: str = None, read_url: str = None, **options) -> AsyncEngine:
+    """Create the engines and session factories for `url` (DATABASE_URL by default).
+
+    Called lazily on first use, or up front to point the bot at another
+    database, e.g. sqlite+aiosqlite:///:memory: for tests and load runs.
+    `read_url` (DATABASE_READ_URL when `url` comes from the environment) is a
+    replica for read_session(). Extra keyword arguments override engine_options().
+    """
+    global _engine, _session_factory, _read_engine, _read_session_factory
+    if url is None:
+        url = database_url()
+        read_url = read_url or os.getenv('DATABASE_READ_URL')
+
+    _engine = _create_engine(url, options)
+    _session_factory = async_sessionmaker(_engine)
+
+    if read_url:
+        _read_engine = _create_engine(_normalize_url(read_url), options)
+        _read_session_factory = async_sessionmaker(_read_engine)
+    else:
+        _read_engine = _read_session_factory = None
+
+    return _engine
+
+
+def get_engine() -> AsyncEngine:
+    if _engine is None:
+        configure()
+    return _engine
+
+
+def get_read_engine():
+    """The replica engine, or None when reads go to the primary"""
+    get_engine()
+    return _read_engine
+
+
+def async_session(**kwargs) -> AsyncSession:
+    if _session_factory is None:
+        configure()
+    return _session_factory(**kwargs)
+
+
+def read_session(**kwargs) -> AsyncSession:
+    """Session for query-only functions: the replica if configured, unless the
+    current user wrote within READ_YOUR_WRITES_WINDOW seconds."""
+    if _session_factory is None:
+        configure()
+    if _read_session_factory is None or recent_writers.get(current_user.get()):
+        return _session_factory(**kwargs)
+    return _read_session_factory(**kwargs)
+
+
+def mark_write():
+    """Pin the current user's reads to the primary for a while after a write"""
+    tg_id = current_user.get()
+    if tg_id is not None and _read_session_factory is not None:
+        recent_writers.set(tg_id, True)
+
+
+async def dispose_engine():
+    global _engine, _session_factory, _read_engine, _read_session_factory
+    for engine in (_engine, _read_engine):
+        if engine is not None:
+            await engine.dispose()
+    _engine = _session_factory = _read_engine = _read_session_factory = None
 
 
 # Define Base class
@@ -37,12 +170,18 @@ class Person(Base):
     phone: Mapped[str] = mapped_column(String(15), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        # Trigram index for ILIKE / similarity lookups on borrower names (needs pg_trgm)
+        Index('ix_persons_name_trgm', 'name',
+              postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
+
 
 class Loan(Base):
     __tablename__ = 'loans'
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    person_id: Mapped[int] = mapped_column(ForeignKey('persons.id'))
+    person_id: Mapped[int] = mapped_column(ForeignKey('persons.id'), index=True)
     total_amount: Mapped[float] = mapped_column(Float)
     remaining_amount: Mapped[float] = mapped_column(Float)
     payment_frequency: Mapped[str] = mapped_column(String(10))  # 'weekly' or 'monthly'
@@ -51,6 +190,32 @@ class Loan(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     status: Mapped[str] = mapped_column(String(20), default='active')
 
+    __table_args__ = (
+        # Partial index matching the active loans list keyset order
+        Index('ix_loans_active_created_at', 'created_at', 'id',
+              postgresql_where=text("status = 'active'"),
+              sqlite_where=text("status = 'active'")),
+    )
+
+
+class Payment(Base):
+    """Append-only ledger of payment adjustments on a loan."""
+    __tablename__ = 'payments'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    loan_id: Mapped[int] = mapped_column(ForeignKey('loans.id'))
+    payments_delta: Mapped[int] = mapped_column(Integer)  # change applied to number_of_payments
+    amount_delta: Mapped[float] = mapped_column(Float)  # change applied to remaining_amount
+    payments_left: Mapped[int] = mapped_column(Integer)  # loan state after this entry
+    remaining_amount: Mapped[float] = mapped_column(Float)
+    created_by: Mapped[int] = mapped_column(BigInteger, nullable=True)  # tg_id of the admin
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # Per-loan history, newest first
+        Index('ix_payments_loan_id_id', 'loan_id', 'id'),
+    )
+
 
 class BannedUser(Base):
     __tablename__ = 'banned_users'
@@ -61,12 +226,32 @@ class BannedUser(Base):
     reason: Mapped[str] = mapped_column(String(100))
 
 
-async def async_main():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+class FsmRecord(Base):
+    __tablename__ = 'fsm_storage'
+
+    key: Mapped[str] = mapped_column(String(200), primary_key=True)
+    state: Mapped[str] = mapped_column(String(100), nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+
+
+class RateLimitBucket(Base):
+    __tablename__ = 'rate_limit_buckets'
+
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float)
+    updated_at: Mapped[float] = mapped_column(Float, index=True)  # epoch seconds, database clock
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    description: Mapped[str] = mapped_column(String(200))
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
 
 async def recreate_tables():
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
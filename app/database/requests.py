@@ -1,8 +1,49 @@
-from app.database.models import Person, Loan, async_session, User, BannedUser
-from sqlalchemy import select
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from app.database.models import Person, Loan, Payment, async_session, read_session, mark_write, get_engine, User, BannedUser, RateLimitBucket
+from app.database.cache import TTLCache
+from sqlalchemy import select, update, delete, func, tuple_, or_, case, literal, extract
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+logger = logging.getLogger(__name__)
+
+# Authorized tg_ids, so auth_required doesn't hit the users table on every update. Refusals
+# aren't cached: /auth in another process must take effect here immediately
+auth_cache = TTLCache(
+    maxsize=int(os.getenv('AUTH_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('AUTH_CACHE_TTL', 300))
+)
+
+# Hard cap on name search results
+SEARCH_LIMIT = 10
+
+# pg_trgm defaults for the % and <% operators, used where pg_trgm is unavailable
+SIMILARITY_THRESHOLD = 0.3
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+# tg_ids from banned_users, loaded at startup and reloaded by refresh_banned_users()
+# so bans and unbans made by other bot processes take effect here too
+banned_ids = set()
+# Bumped on every local ban change, so a reload that raced one doesn't undo it
+_ban_generation = 0
+
+# Portfolio snapshot for /stats, dropped by every loan mutation in this process;
+# the TTL bounds staleness from other processes and bulk imports elsewhere
+stats_cache = TTLCache(maxsize=1, ttl=float(os.getenv('STATS_CACHE_TTL', 300)))
+_stats_lock = asyncio.Lock()
+# Bumped by invalidate_stats(), so a snapshot computed across a loan change isn't cached
+_stats_generation = 0
+
+# Callables notified with a loan's schedule fields after it changes (see app.reminders)
+loan_listeners = []
 
 
 async def create_person(name: str, phone: str = None):
+    mark_write()
     async with async_session() as session:
         async with session.begin():
             existing_person = await session.scalar(
@@ -20,6 +61,7 @@ async def create_person(name: str, phone: str = None):
 
 async def create_loan(person_id: int, total_amount: float, payment_frequency: str,
                       number_of_payments: int, payment_amount: float):
+    mark_write()
     async with async_session() as session:
         async with session.begin():
             person = await session.scalar(
@@ -40,11 +82,16 @@ async def create_loan(person_id: int, total_amount: float, payment_frequency: st
             )
             session.add(new_loan)
             await session.flush()
-            return {'id': new_loan.id}
+            # Read the values now: the instance expires when the transaction commits
+            fields = _loan_fields(new_loan)
+
+    invalidate_stats()
+    _loan_changed(fields)
+    return {'id': fields['id']}
 
 
 async def get_all_loans():
-    async with async_session() as session:
+    async with read_session() as session:
         query = select(Loan, Person).join(Person, Loan.person_id == Person.id) \
             .where(Loan.status == 'active') \
             .order_by(Loan.created_at.desc())
@@ -66,8 +113,54 @@ async def get_all_loans():
         return loans
 
 
+async def count_active_loans() -> int:
+    async with read_session() as session:
+        query = select(func.count(Loan.id)).where(Loan.status == 'active')
+        return await session.scalar(query)
+
+
+async def get_active_loans_page(limit: int = 5, after: tuple = None, before: tuple = None):
+    """Keyset page of active loans ordered by (created_at, id) desc.
+
+    `after` and `before` are (created_at, id) cursors taken from the last or
+    first loan of the page currently shown, so any page costs the same as
+    the first one.
+    """
+    async with read_session() as session:
+        query = select(Loan, Person).join(Person, Loan.person_id == Person.id) \
+            .where(Loan.status == 'active')
+
+        if before is not None:
+            query = query.where(tuple_(Loan.created_at, Loan.id) > tuple_(*before)) \
+                .order_by(Loan.created_at.asc(), Loan.id.asc())
+        else:
+            if after is not None:
+                query = query.where(tuple_(Loan.created_at, Loan.id) < tuple_(*after))
+            query = query.order_by(Loan.created_at.desc(), Loan.id.desc())
+
+        result = await session.execute(query.limit(limit))
+        rows = result.all()
+        if before is not None:
+            rows.reverse()
+
+        loans = []
+        for loan, person in rows:
+            loans.append({
+                'id': loan.id,
+                'person_name': person.name,
+                'total_amount': loan.total_amount,
+                'remaining_amount': loan.remaining_amount,
+                'payment_amount': loan.payment_amount,
+                'frequency': loan.payment_frequency,
+                'payments_left': loan.number_of_payments,
+                'status': loan.status,
+                'created_at': loan.created_at
+            })
+        return loans
+
+
 async def get_loan_details(loan_id: int):
-    async with async_session() as session:
+    async with read_session() as session:
         query = select(Loan, Person).join(Person, Loan.person_id == Person.id) \
             .where(Loan.id == loan_id)
 
@@ -90,46 +183,291 @@ async def get_loan_details(loan_id: int):
         return None
 
 
-async def update_loan_payment_details(loan_id: int, new_payments_count: int):
+async def update_loan_payment_details(loan_id: int, new_payments_count: int, tg_id: int = None):
+    mark_write()
     async with async_session() as session:
         async with session.begin():
             # Get the loan
-            loan = await session.get(Loan, loan_id)
-            if loan and new_payments_count >= 0:
+            loan = await session.get(Loan, loan_id, with_for_update=True)
+            if not loan or new_payments_count < 0:
+                return False
 
-                new_remaining_amount = loan.payment_amount * new_payments_count
-                loan.number_of_payments = new_payments_count
-                loan.remaining_amount = new_remaining_amount
+            old_payments_count = loan.number_of_payments
+            old_remaining_amount = loan.remaining_amount
+
+            new_remaining_amount = loan.payment_amount * new_payments_count
+            loan.number_of_payments = new_payments_count
+            loan.remaining_amount = new_remaining_amount
+
+            if new_payments_count == 0:
+                loan.status = 'completed'
+                loan.remaining_amount = 0  # Ensure remaining amount is 0 when completed
+
+            session.add(Payment(
+                loan_id=loan_id,
+                payments_delta=new_payments_count - old_payments_count,
+                amount_delta=loan.remaining_amount - old_remaining_amount,
+                payments_left=loan.number_of_payments,
+                remaining_amount=loan.remaining_amount,
+                created_by=tg_id
+            ))
+            fields = _loan_fields(loan)
+
+    invalidate_stats()
+    _loan_changed(fields)
+    return True
+
+
+def _adjust_loan_query(loan_id: int, delta: int, guarded: bool):
+    """UPDATE adding `delta` payments, optionally only when it doesn't go below zero"""
+    # Borrower name comes from a correlated subquery: SQLite can't RETURN
+    # columns of an UPDATE ... FROM table
+    loans, persons = Loan.__table__, Person.__table__
+    person_name = select(persons.c.name) \
+        .where(persons.c.id == loans.c.person_id) \
+        .scalar_subquery()
+    new_payments_count = loans.c.number_of_payments + delta
+
+    query = update(loans).where(loans.c.id == loan_id)
+    if guarded:
+        query = query.where(new_payments_count >= 0)
+
+    return query.values(
+        number_of_payments=new_payments_count,
+        # remaining_amount is maintained incrementally, the ledger holds the history
+        remaining_amount=case(
+            (new_payments_count == 0, 0),
+            else_=loans.c.remaining_amount + loans.c.payment_amount * delta
+        ),
+        status=case(
+            (new_payments_count == 0, 'completed'),
+            else_=loans.c.status
+        )
+    ).returning(
+        loans.c.id, person_name.label('person_name'),
+        loans.c.total_amount, loans.c.remaining_amount, loans.c.payment_amount,
+        loans.c.payment_frequency, loans.c.number_of_payments,
+        loans.c.status, loans.c.created_at
+    )
+
+
+async def adjust_loan_payments(loan_id: int, delta: int, tg_id: int = None):
+    """Add `delta` payments to a loan with UPDATE ... RETURNING and record it
+    in the payments ledger in the same transaction.
+
+    The count is clamped at zero and the loan is completed server-side, so
+    concurrent taps can't overwrite each other. Returns the updated loan
+    details or None if the loan doesn't exist.
+    """
+    mark_write()
+    async with async_session() as session:
+        async with session.begin():
+            row = (await session.execute(_adjust_loan_query(loan_id, delta, guarded=True))).first()
+
+            if row is None:
+                # Missing loan, or the change would go below zero: clamp under a row lock
+                loan = await session.get(Loan, loan_id, with_for_update=True)
+                if loan is None:
+                    return None
+                delta = -loan.number_of_payments
+                row = (await session.execute(_adjust_loan_query(loan_id, delta, guarded=False))).first()
+
+            if delta:
+                session.add(Payment(
+                    loan_id=loan_id,
+                    payments_delta=delta,
+                    amount_delta=row.payment_amount * delta,
+                    payments_left=row.number_of_payments,
+                    remaining_amount=row.remaining_amount,
+                    created_by=tg_id
+                ))
+
+        if delta:
+            # After COMMIT, so a /stats recompute can't cache the pre-change totals
+            invalidate_stats()
+            _loan_changed(_loan_fields(row))
+
+        return {
+            'id': row.id,
+            'person_name': row.person_name,
+            'total_amount': row.total_amount,
+            'remaining_amount': row.remaining_amount,
+            'payment_amount': row.payment_amount,
+            'frequency': row.payment_frequency,
+            'payments_left': row.number_of_payments,
+            'status': row.status,
+            'created_at': row.created_at.strftime("%Y-%m-%d")
+        }
+
+
+def _loan_fields(loan) -> dict:
+    """Schedule fields of a loan instance or RETURNING row, as passed to loan_listeners"""
+    return {
+        'id': loan.id,
+        'total_amount': loan.total_amount,
+        'remaining_amount': loan.remaining_amount,
+        'payment_amount': loan.payment_amount,
+        'frequency': loan.payment_frequency,
+        'status': loan.status,
+        'created_at': loan.created_at
+    }
+
+
+def _loan_changed(fields: dict):
+    """Notify loan_listeners after the change has committed; their failures don't fail the write"""
+    for listener in loan_listeners:
+        try:
+            listener(fields)
+        except Exception:
+            logger.exception("Loan listener %r failed for loan %s", listener, fields['id'])
 
-                if new_payments_count == 0:
-                    loan.status = 'completed'
-                    loan.remaining_amount = 0  # Ensure remaining amount is 0 when completed
 
-                await session.commit()
-                return True
-            return False
+def loans_inserted(loans: list):
+    """Report loans bulk-inserted outside this module (schedule field dicts) once committed"""
+    invalidate_stats()
+    if loan_listeners:
+        for fields in loans:
+            _loan_changed(fields)
 
 
-async def is_user_authorized(tg_id: int) -> bool:
+async def get_loan_schedules():
+    """Schedule fields of every active loan, loaded once by the reminder scheduler"""
     async with async_session() as session:
+        query = select(
+            Loan.id, Loan.total_amount, Loan.remaining_amount, Loan.payment_amount,
+            Loan.payment_frequency, Loan.status, Loan.created_at
+        ).where(Loan.status == 'active')
+
+        result = await session.execute(query)
+        return [
+            {
+                'id': row.id,
+                'total_amount': row.total_amount,
+                'remaining_amount': row.remaining_amount,
+                'payment_amount': row.payment_amount,
+                'frequency': row.payment_frequency,
+                'status': row.status,
+                'created_at': row.created_at
+            }
+            for row in result
+        ]
+
+
+def invalidate_stats():
+    global _stats_generation
+    _stats_generation += 1
+    stats_cache.invalidate('portfolio')
+
+
+async def get_portfolio_stats(top: int = 5) -> dict:
+    """Portfolio totals computed with aggregate SQL, cached until the next loan change"""
+    snapshot = stats_cache.get('portfolio')
+    if snapshot is not None:
+        return snapshot
+
+    async with _stats_lock:
+        # Another admin may have computed it while we waited
+        snapshot = stats_cache.get('portfolio')
+        if snapshot is not None:
+            return snapshot
+
+        generation = _stats_generation
+        async with async_session() as session:
+            groups = await session.execute(
+                select(
+                    Loan.status, Loan.payment_frequency, func.count(Loan.id),
+                    func.sum(Loan.remaining_amount), func.sum(Loan.payment_amount)
+                ).group_by(Loan.status, Loan.payment_frequency)
+            )
+            largest = await session.execute(
+                select(Loan.id, Person.name, Loan.remaining_amount)
+                .join(Person, Loan.person_id == Person.id)
+                .where(Loan.status == 'active')
+                .order_by(Loan.remaining_amount.desc())
+                .limit(top)
+            )
+
+            snapshot = {
+                'outstanding': 0.0,
+                'by_status': {},
+                'by_frequency': {},
+                'weekly_inflow': 0.0,
+                'monthly_inflow': 0.0,
+                'largest': [
+                    {'id': loan_id, 'person_name': name, 'remaining_amount': remaining}
+                    for loan_id, name, remaining in largest
+                ],
+                'computed_at': datetime.now()
+            }
+            for status, frequency, count, remaining, payments in groups:
+                snapshot['by_status'][status] = snapshot['by_status'].get(status, 0) + count
+                if status != 'active':
+                    continue
+                snapshot['by_frequency'][frequency] = snapshot['by_frequency'].get(frequency, 0) + count
+                snapshot['outstanding'] += remaining or 0
+                # Expected inflow from scheduled payments (52 weeks / 12 months a year)
+                if frequency == 'weekly':
+                    snapshot['weekly_inflow'] += payments or 0
+                    snapshot['monthly_inflow'] += (payments or 0) * 52 / 12
+                else:
+                    snapshot['monthly_inflow'] += payments or 0
+                    snapshot['weekly_inflow'] += (payments or 0) * 12 / 52
+
+        if generation == _stats_generation:
+            stats_cache.set('portfolio', snapshot)
+        return snapshot
+
+
+async def get_loan_payments(loan_id: int, limit: int = 10, before_id: int = None):
+    """Newest ledger entries of a loan, keyset paged by payment id"""
+    async with read_session() as session:
+        query = select(Payment).where(Payment.loan_id == loan_id)
+        if before_id is not None:
+            query = query.where(Payment.id < before_id)
+        query = query.order_by(Payment.id.desc()).limit(limit)
+
+        result = await session.scalars(query)
+        return [
+            {
+                'id': payment.id,
+                'payments_delta': payment.payments_delta,
+                'amount_delta': payment.amount_delta,
+                'payments_left': payment.payments_left,
+                'remaining_amount': payment.remaining_amount,
+                'created_by': payment.created_by,
+                'created_at': payment.created_at
+            }
+            for payment in result
+        ]
+
+
+async def is_user_authorized(tg_id: int) -> bool:
+    if auth_cache.get(tg_id):
+        return True
+
+    async with read_session() as session:
         try:
             query = select(User).where(User.tg_id == tg_id)
             result = await session.execute(query)
             user = result.scalar_one_or_none()
 
             if user is None:
-                print(f"User {tg_id} not found in database")
+                logger.debug("User %s not found in database", tg_id)
                 return False
 
-            print(f"User {tg_id} found, authorized status: {user.is_authorized}")
+            logger.debug("User %s found, authorized status: %s", tg_id, user.is_authorized)
+            if user.is_authorized:
+                auth_cache.set(tg_id, True)
             return user.is_authorized
 
         except Exception as e:
-            print(f"Error checking authorization: {e}")
+            logger.error("Error checking authorization: %s", e)
             return False
 
 
 async def authorize_user(tg_id: int) -> bool:
+    mark_write()
+    auth_cache.invalidate(tg_id)
     async with async_session() as session:
         try:
             async with session.begin():
@@ -138,40 +476,64 @@ async def authorize_user(tg_id: int) -> bool:
                 user = result.scalar_one_or_none()
 
                 if user:
-                    print(f"Updating existing user {tg_id}")
+                    logger.info("Updating existing user %s", tg_id)
                     user.is_authorized = True
                 else:
-                    print(f"Creating new user {tg_id}")
+                    logger.info("Creating new user %s", tg_id)
                     new_user = User(tg_id=tg_id, is_authorized=True)
                     session.add(new_user)
 
+            auth_cache.invalidate(tg_id)
 
             verify_query = select(User).where(User.tg_id == tg_id)
             verify_result = await session.execute(verify_query)
             verified_user = verify_result.scalar_one_or_none()
 
             if verified_user and verified_user.is_authorized:
-                print(f"Successfully verified user {tg_id} is authorized")
+                logger.info("Successfully verified user %s is authorized", tg_id)
                 return True
 
             return False
 
         except Exception as e:
-            print(f"Error in authorize_user: {e}")
+            logger.error("Error in authorize_user: %s", e)
             return False
 
 
-async def search_loans_by_name(name: str):
-    """Search loans by borrower name"""
-    async with async_session() as session:
-        query = select(Loan, Person).join(Person, Loan.person_id == Person.id) \
-            .where(Person.name.ilike(f"%{name}%")) \
-            .order_by(Loan.created_at.desc())
+async def search_loans_by_name(name: str, limit: int = SEARCH_LIMIT):
+    """Search loans by borrower name, best trigram matches first"""
+    limit = min(limit, SEARCH_LIMIT)
+    term = literal(name)
+    name_similarity = func.similarity(Person.name, term)
+    name_word_similarity = func.word_similarity(term, Person.name)
+
+    if get_engine().dialect.name == 'postgresql':
+        # All three predicates are served by the persons name trigram index
+        score = func.greatest(name_similarity, name_word_similarity)
+        match = or_(
+            Person.name.op('%')(term),
+            term.op('<%')(Person.name),
+            Person.name.ilike(f"%{name}%")
+        )
+    else:
+        score = func.max(name_similarity, name_word_similarity)
+        match = or_(
+            name_similarity >= SIMILARITY_THRESHOLD,
+            name_word_similarity >= WORD_SIMILARITY_THRESHOLD,
+            Person.name.ilike(f"%{name}%")
+        )
+
+    async with read_session() as session:
+        query = select(Loan, Person, score.label('score')) \
+            .join(Person, Loan.person_id == Person.id) \
+            .where(match) \
+            .order_by(score.desc(), Loan.created_at.desc()) \
+            .limit(limit)
 
         result = await session.execute(query)
         loans = []
 
-        for loan, person in result:
+        for loan, person, match_score in result:
             loans.append({
                 'id': loan.id,
                 'person_name': person.name,
@@ -180,7 +542,8 @@ async def search_loans_by_name(name: str):
                 'payment_amount': loan.payment_amount,
                 'frequency': loan.payment_frequency,
                 'payments_left': loan.number_of_payments,
-                'status': loan.status
+                'status': loan.status,
+                'score': match_score
             })
 
         return loans
@@ -194,44 +557,157 @@ async def get_banned_users(tg_id: int):
         return user
 
 
+async def load_banned_users():
+    generation = _ban_generation
+    async with async_session() as session:
+        result = await session.scalars(select(BannedUser.tg_id))
+        loaded = set(result.all())
+
+    # A ban change committed here meanwhile may be missing from the result; the next reload has it
+    if generation == _ban_generation:
+        banned_ids.clear()
+        banned_ids.update(loaded)
+    return len(banned_ids)
+
+
+async def refresh_banned_users(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await load_banned_users()
+        except Exception:
+            logger.exception("Reloading the ban list failed")
+
+
+def _ban_changed(tg_id: int, banned: bool):
+    global _ban_generation
+    _ban_generation += 1
+    if banned:
+        banned_ids.add(tg_id)
+    else:
+        banned_ids.discard(tg_id)
+
+
+def is_banned(tg_id: int) -> bool:
+    return tg_id in banned_ids
+
+
 async def add_banned_user(tg_id: int, reason: str = "Rate limit exceeded too many times"):
+    mark_write()
     async with async_session() as session:
         async with session.begin():
             existing_user = await get_banned_users(tg_id)
 
             if existing_user:
+                _ban_changed(tg_id, True)
                 return False
 
             banned_user = BannedUser(tg_id=tg_id, reason=reason)
             session.add(banned_user)
-            return True
+
+    _ban_changed(tg_id, True)
+    return True
 
 
 async def get_authorized_users():
-    async with async_session() as session:
+    async with read_session() as session:
         query = select(User).where(User.is_authorized == True)
         result = await session.execute(query)
         return result.scalars().all()
 
 
 async def is_admin(tg_id: int) -> bool:
-    async with async_session() as session:
+    async with read_session() as session:
         query = select(User).where(User.tg_id == tg_id, User.is_authorized == True)
         result = await session.execute(query)
         return result.scalar_one_or_none() is not None
 
 
 async def unban_user(tg_id: int) -> bool:
+    mark_write()
     async with async_session() as session:
         async with session.begin():
             banned_user = await get_banned_users(tg_id)
             if banned_user:
                 await session.delete(banned_user)
-                return True
-            return False
+
+    _ban_changed(tg_id, False)
+    return banned_user is not None
 
 async def get_all_banned_users():
-    async with async_session() as session:
+    async with read_session() as session:
         query = select(BannedUser).order_by(BannedUser.banned_at.desc())
         result = await session.execute(query)
-        return result.scalars().all()
\ No newline at end of file
+        return result.scalars().all()
+
+
+def _db_now():
+    """Current epoch seconds on the database clock, shared by all bot processes"""
+    if get_engine().dialect.name == 'postgresql':
+        return extract('epoch', func.clock_timestamp())
+    return (func.julianday('now') - 2440587.5) * 86400.0
+
+
+async def take_rate_limit_token(key: str, capacity: int, refill_rate: float) -> float:
+    """Refill and take one token from a shared bucket in a single statement.
+
+    Returns the tokens left after the attempt; a negative value means the
+    caller is rate limited. Debt is capped at one token so a flood doesn't
+    lock the key out forever.
+    """
+    query, refilled, greatest = _bucket_upsert(key, capacity, refill_rate, 1)
+    query = query.on_conflict_do_update(
+        index_elements=[RateLimitBucket.key],
+        set_={
+            'tokens': greatest(refilled - 1, -1),
+            'updated_at': query.excluded.updated_at
+        }
+    ).returning(RateLimitBucket.tokens)
+
+    async with async_session() as session:
+        async with session.begin():
+            return await session.scalar(query)
+
+
+async def take_rate_limit_tokens(key: str, capacity: int, refill_rate: float, amount: int) -> bool:
+    """Take `amount` tokens from a shared bucket if all of them are available, else none"""
+    query, refilled, _ = _bucket_upsert(key, capacity, refill_rate, amount)
+    query = query.on_conflict_do_update(
+        index_elements=[RateLimitBucket.key],
+        set_={
+            'tokens': refilled - amount,
+            'updated_at': query.excluded.updated_at
+        },
+        where=refilled >= amount
+    ).returning(RateLimitBucket.tokens)
+
+    async with async_session() as session:
+        async with session.begin():
+            return await session.scalar(query) is not None
+
+
+def _bucket_upsert(key: str, capacity: int, refill_rate: float, amount: int):
+    """INSERT of a new bucket with `amount` taken, the refilled token count of an existing one
+    and the dialect's greatest()"""
+    buckets = RateLimitBucket.__table__
+    if get_engine().dialect.name == 'postgresql':
+        insert, least, greatest = pg_insert, func.least, func.greatest
+    else:
+        insert, least, greatest = sqlite_insert, func.min, func.max
+
+    query = insert(buckets).values(key=key, tokens=capacity - amount, updated_at=_db_now())
+    refilled = least(
+        capacity,
+        buckets.c.tokens + (query.excluded.updated_at - buckets.c.updated_at) * refill_rate
+    )
+    return query, refilled, greatest
+
+
+async def purge_rate_limit_buckets(idle_seconds: float) -> int:
+    """Delete buckets untouched for idle_seconds (they would be full again anyway)"""
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                delete(RateLimitBucket).where(RateLimitBucket.updated_at < _db_now() - idle_seconds)
+            )
+            return result.rowcount
@@ -0,0 +1,32 @@
+"""Pure Python versions of the pg_trgm functions used by borrower search.
+
+They are registered as SQL functions on SQLite connections so the same
+search query runs against the test backend.
+"""
+import re
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def trigrams(value: str) -> set:
+    """Trigram set of a string, padded per word like pg_trgm."""
+    result = set()
+    for word in _WORD_RE.findall((value or '').lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a: str, b: str) -> float:
+    first, second = trigrams(a), trigrams(b)
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def word_similarity(a: str, b: str) -> float:
+    """Share of the trigrams of `a` that occur somewhere in `b`."""
+    first = trigrams(a)
+    if not first:
+        return 0.0
+    return len(first & trigrams(b)) / len(first)
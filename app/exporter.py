@@ -0,0 +1,117 @@
+"""Streaming export of all loans with their borrowers to CSV or Parquet.
+
+Rows are read in keyset chunks by loan id, each chunk in its own short read
+through a server-side cursor, so memory stays flat and no transaction stays
+open for the whole export. The CSV columns are accepted by app.importer.
+
+    python -m app.exporter loans.csv [--format parquet]
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import time
+
+from sqlalchemy import select
+
+from app.database.models import Person, Loan, async_session, dispose_engine
+from app.log_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    'loan_id', 'person_id', 'name', 'phone', 'total_amount', 'remaining_amount',
+    'payment_amount', 'payment_frequency', 'number_of_payments', 'status', 'created_at'
+)
+
+
+async def iter_loan_chunks(chunk_size: int = 5000):
+    """Yield lists of export rows (tuples in COLUMNS order)."""
+    last_id = 0
+    while True:
+        query = select(
+            Loan.id, Person.id, Person.name, Person.phone, Loan.total_amount,
+            Loan.remaining_amount, Loan.payment_amount, Loan.payment_frequency,
+            Loan.number_of_payments, Loan.status, Loan.created_at
+        ).join(Person, Loan.person_id == Person.id) \
+            .where(Loan.id > last_id) \
+            .order_by(Loan.id) \
+            .limit(chunk_size) \
+            .execution_options(yield_per=1000)
+
+        async with async_session() as session:
+            result = await session.stream(query)
+            chunk = [tuple(row) async for row in result]
+
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+async def export_csv(f, chunk_size: int = 5000) -> int:
+    """Write all loans to a text file object, returns the row count."""
+    writer = csv.writer(f)
+    writer.writerow(COLUMNS)
+    count = 0
+    async for chunk in iter_loan_chunks(chunk_size):
+        writer.writerows(
+            (*row[:-1], row[-1].isoformat() if row[-1] else None) for row in chunk
+        )
+        count += len(chunk)
+    return count
+
+
+async def export_parquet(path: str, chunk_size: int = 5000) -> int:
+    """Write all loans to a Parquet file, one row group per chunk (needs pyarrow)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+
+    schema = pa.schema([
+        ('loan_id', pa.int64()), ('person_id', pa.int64()), ('name', pa.string()),
+        ('phone', pa.string()), ('total_amount', pa.float64()), ('remaining_amount', pa.float64()),
+        ('payment_amount', pa.float64()), ('payment_frequency', pa.string()),
+        ('number_of_payments', pa.int64()), ('status', pa.string()), ('created_at', pa.timestamp('us'))
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        async for chunk in iter_loan_chunks(chunk_size):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            count += len(chunk)
+    return count
+
+
+async def export_loans(path: str, fmt: str = 'csv', chunk_size: int = 5000) -> int:
+    if fmt == 'parquet':
+        return await export_parquet(path, chunk_size)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        return await export_csv(f, chunk_size)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Export all loans to CSV or Parquet")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'parquet'))
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    fmt = args.format or ('parquet' if args.path.endswith('.parquet') else 'csv')
+    started = time.perf_counter()
+    try:
+        count = await export_loans(args.path, fmt, args.chunk_size)
+    finally:
+        # aiosqlite keeps a worker thread per connection that would block interpreter exit
+        await dispose_engine()
+    logger.info("Exported %s loans to %s in %.1fs", count, args.path, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(main())
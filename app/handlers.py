@@ -1,17 +1,39 @@
-from datetime import timedelta
-from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+import io
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from aiogram import Bot, Router, F
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
 
 from app.keyboards import *
+from app.callbacks import (
+    CallbackRouter, SelectFrequency, ConfirmLoan, AdjustPayments, BackToLoans, ViewLoan,
+    LoanHistory, Page, PageInfo, SearchName, CancelSearch
+)
 from app.database import requests as rq
+from app.database.models import get_engine, get_read_engine
+from app.database.pool import pool_stats
+from app.coalescer import TapCoalescer
+from app.importer import import_loans, iter_records, detect_format
+from app.exporter import export_loans
 from security import rate_limit, auth_required, check_password
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
+# Inline buttons are routed by their callback data action, see app/callbacks.py
+callbacks = CallbackRouter()
+callbacks.setup(router)
+
+LOANS_PER_PAGE = 5
+
 
 class AuthStates(StatesGroup):
     awaiting_password = State()
@@ -34,6 +56,19 @@ class SearchStates(StatesGroup):
     awaiting_status = State()
 
 
+def loan_details_text(loan):
+    return (
+        f"💰 Loan Details for {loan['person_name']}\n\n"
+        f"📅 Created: {loan['created_at']}\n"
+        f"💵 Total Amount: ${loan['total_amount']:,.2f}\n"
+        f"🏷️ Remaining: ${loan['remaining_amount']:,.2f}\n"
+        f"💸 Payment Amount: ${loan['payment_amount']:,.2f}\n"
+        f"🔄 Frequency: {loan['frequency'].title()}\n"
+        f"📊 Payments Left: {loan['payments_left']}\n"
+        f"📌 Status: {loan['status'].title()}"
+    )
+
+
 # Start command
 @router.message(Command("start"))
 async def cmd_start(message: Message):
@@ -56,10 +91,10 @@ async def cmd_start(message: Message):
 @rate_limit(max_attempts=5, window=timedelta(minutes=15))
 async def cmd_auth(message: Message):
     user_id = message.from_user.id
-    print(f"\nAuth attempt by user {user_id}")
+    logger.info("Auth attempt by user %s", user_id)
 
     current_auth = await rq.is_user_authorized(user_id)
-    print(f"Current authorization status: {current_auth}")
+    logger.debug("Current authorization status: %s", current_auth)
 
     if current_auth:
         await message.answer("You are already authorized!")
@@ -67,16 +102,16 @@ async def cmd_auth(message: Message):
 
     try:
         password = message.text.split()[1]
-        print("Password provided by user")
+        logger.debug("Password provided by user")
     except IndexError:
         await message.answer("Please provide a password: /auth [password]")
         return False
 
     if await check_password(password):
-        print("Password correct, attempting to authorize...")
+        logger.info("Password correct, authorizing user %s", user_id)
         success = await rq.authorize_user(user_id)
         if success:
-            print("Authorization successful")
+            logger.info("Authorization successful for user %s", user_id)
             await message.answer(
                 "✅ You have been authorized!\n"
                 "Use the buttons below to manage loans:",
@@ -84,11 +119,11 @@ async def cmd_auth(message: Message):
             )
             return True
         else:
-            print("Authorization failed")
+            logger.warning("Authorization failed for user %s", user_id)
             await message.answer("There was an error authorizing you. Please try again.")
             return False
     else:
-        print("Invalid password provided")
+        logger.warning("Invalid password provided by user %s", user_id)
         await message.answer("❌ Invalid password. Please try again.")
         return False
 
@@ -144,10 +179,10 @@ async def process_amount(message: Message, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data.startswith('freq_'))
+@callbacks.on(SelectFrequency)
 @auth_required
-async def process_frequency(callback: CallbackQuery, state: FSMContext):
-    frequency = callback.data.split('_')[1]
+async def process_frequency(callback: CallbackQuery, callback_data: SelectFrequency, state: FSMContext):
+    frequency = callback_data.frequency
 
     await state.update_data(frequency=frequency)
 
@@ -196,10 +231,10 @@ async def process_payments(message: Message, state: FSMContext):
     await message.answer(text=summary, reply_markup=confirm_keyboard())
 
 
-@router.callback_query(lambda c: c.data in ["confirm_loan", "cancel_loan"])
+@callbacks.on(ConfirmLoan)
 @auth_required
-async def process_confirmation(callback: CallbackQuery, state: FSMContext):
-    if callback.data == "confirm_loan":
+async def process_confirmation(callback: CallbackQuery, callback_data: ConfirmLoan, state: FSMContext):
+    if callback_data.confirmed:
         data = await state.get_data()
 
         try:
@@ -227,8 +262,7 @@ async def process_confirmation(callback: CallbackQuery, state: FSMContext):
             )
 
         except Exception as e:
-            error_message = f"Error creating loan: {str(e)}"
-            print(error_message)
+            logger.exception("Error creating loan: %s", e)
             await callback.message.answer(
                 "❌ There was an error creating the loan. Please try again.",
                 reply_markup=main()
@@ -260,86 +294,80 @@ async def search_loans(message: Message):
 @router.message(F.text == "View All Loans")
 @auth_required
 async def view_all_loans(message: Message):
-    loans = await rq.get_all_loans()
+    total_loans = await rq.count_active_loans()
 
-    if not loans:
+    if not total_loans:
         await message.answer(
             "No active loans found.",
             reply_markup=main()
         )
         return
 
-    total_loans = len(loans)
+    loans = await rq.get_active_loans_page(limit=LOANS_PER_PAGE)
     await message.answer(
         f"📊 Total Active Loans: {total_loans}\n\nSelect a loan to manage:",
-        reply_markup=loans_list_keyboard(loans, current_page=0)
+        reply_markup=loans_list_keyboard(loans, current_page=0, total_loans=total_loans)
     )
 
 
-@router.callback_query(lambda c: c.data.startswith(('decrease_', 'increase_')))
-@auth_required
-async def adjust_payments(callback: CallbackQuery):
-    action, loan_id = callback.data.split('_')
-    loan_id = int(loan_id)
+async def flush_payment_taps(key, delta: int, message: Message):
+    """Apply a burst of add/remove taps on one loan as a single update and edit"""
+    loan_id, tg_id = key
+    if not delta:
+        return  # The taps cancelled out
 
-    loan = await rq.get_loan_details(loan_id)
+    updated_loan = await rq.adjust_loan_payments(loan_id, delta, tg_id=tg_id)
 
-    if not loan:
-        await callback.answer("Loan not found!")
+    if not updated_loan:
+        await message.edit_text("Loan not found. Please try again.")
         return
 
-    current_payments = loan['payments_left']
-    new_payments = current_payments + 1 if action == 'increase' else max(0, current_payments - 1)
-
-    success = await rq.update_loan_payment_details(loan_id, new_payments)
-
-    if success:
-        updated_loan = await rq.get_loan_details(loan_id)
-        if updated_loan:
-            details = (
-                f"💰 Loan Details for {updated_loan['person_name']}\n\n"
-                f"📅 Created: {updated_loan['created_at']}\n"
-                f"💵 Total Amount: ${updated_loan['total_amount']:,.2f}\n"
-                f"🏷️ Remaining: ${updated_loan['remaining_amount']:,.2f}\n"
-                f"💸 Payment Amount: ${updated_loan['payment_amount']:,.2f}\n"
-                f"🔄 Frequency: {updated_loan['frequency'].title()}\n"
-                f"📊 Payments Left: {updated_loan['payments_left']}\n"
-                f"📌 Status: {updated_loan['status'].title()}"
-            )
+    await message.edit_text(
+        loan_details_text(updated_loan),
+        reply_markup=loan_details_keyboard(loan_id)
+    )
 
-            await callback.message.edit_text(
-                details,
-                reply_markup=loan_details_keyboard(loan_id)
-            )
 
-            action_text = "Added a payment" if action == 'increase' else "Removed a payment"
-            await callback.answer(f"{action_text}")
-    else:
-        await callback.answer("Failed to update payments")
+# Taps on the same loan by the same admin within the window become one write
+payment_taps = TapCoalescer(flush_payment_taps, window=float(os.getenv('ADJUST_COALESCE_WINDOW', 0.5)))
 
 
-@router.callback_query(lambda c: c.data == "back_to_loans")
+@callbacks.on(AdjustPayments)
+@auth_required
+async def adjust_payments(callback: CallbackQuery, callback_data: AdjustPayments):
+    net = payment_taps.add(
+        (callback_data.loan_id, callback.from_user.id), callback_data.delta, callback.message
+    )
+
+    action_text = "Added a payment" if callback_data.delta > 0 else "Removed a payment"
+    if net != callback_data.delta:
+        action_text += f" ({net:+d} pending)"
+    await callback.answer(action_text)
+
+
+@callbacks.on(BackToLoans)
 @auth_required
 async def back_to_loans_list(callback: CallbackQuery):
-    loans = await rq.get_all_loans()
-    if not loans:
+    total_loans = await rq.count_active_loans()
+    if not total_loans:
         await callback.message.edit_text(
             "No active loans found.",
             reply_markup=main()
         )
         return
 
+    loans = await rq.get_active_loans_page(limit=LOANS_PER_PAGE)
     await callback.message.edit_text(
         "Select a loan to manage:",
-        reply_markup=loans_list_keyboard(loans)
+        reply_markup=loans_list_keyboard(loans, current_page=0, total_loans=total_loans)
     )
     await callback.answer()
 
 
-@router.callback_query(lambda c: c.data.startswith('view_loan_'))
+@callbacks.on(ViewLoan)
 @auth_required
-async def view_loan_details(callback: CallbackQuery):
-    loan_id = int(callback.data.split('_')[2])
+async def view_loan_details(callback: CallbackQuery, callback_data: ViewLoan):
+    loan_id = callback_data.loan_id
     loan = await rq.get_loan_details(loan_id)
 
     if not loan:
@@ -350,33 +378,52 @@ async def view_loan_details(callback: CallbackQuery):
         )
         return
 
-    details = (
-        f"💰 Loan Details for {loan['person_name']}\n\n"
-        f"📅 Created: {loan['created_at']}\n"
-        f"💵 Total Amount: ${loan['total_amount']:,.2f}\n"
-        f"🏷️ Remaining: ${loan['remaining_amount']:,.2f}\n"
-        f"💸 Payment Amount: ${loan['payment_amount']:,.2f}\n"
-        f"🔄 Frequency: {loan['frequency'].title()}\n"
-        f"📊 Payments Left: {loan['payments_left']}\n"
-        f"📌 Status: {loan['status'].title()}"
-    )
-
     await callback.message.edit_text(
-        details,
+        loan_details_text(loan),
         reply_markup=loan_details_keyboard(loan_id)
     )
     await callback.answer()
 
 
-@router.callback_query(lambda c: c.data.startswith('page_'))
+@callbacks.on(LoanHistory)
 @auth_required
-async def handle_pagination(callback: CallbackQuery):
-    if callback.data == "page_info":
-        await callback.answer()
-        return
+async def view_loan_history(callback: CallbackQuery, callback_data: LoanHistory):
+    loan_id = callback_data.loan_id
+    payments = await rq.get_loan_payments(loan_id, limit=10)
+
+    if not payments:
+        text = "📜 No payment changes recorded for this loan yet."
+    else:
+        text = "📜 Latest payment changes:\n\n"
+        for payment in payments:
+            sign = "➕" if payment['payments_delta'] > 0 else "➖"
+            text += (
+                f"{payment['created_at']:%Y-%m-%d %H:%M} {sign} {abs(payment['payments_delta'])} "
+                f"→ {payment['payments_left']} left, ${payment['remaining_amount']:,.2f}\n"
+            )
+
+    await callback.message.edit_text(text, reply_markup=loan_history_keyboard(loan_id))
+    await callback.answer()
+
+
+@callbacks.on(PageInfo)
+async def page_info(callback: CallbackQuery):
+    await callback.answer()
 
-    page = int(callback.data.split('_')[1])
-    loans = await rq.get_all_loans()
+
+@callbacks.on(Page)
+@auth_required
+async def handle_pagination(callback: CallbackQuery, callback_data: Page):
+    page = callback_data.page
+    cursor = (callback_data.created_at, callback_data.loan_id)
+
+    total_loans = await rq.count_active_loans()
+    if page == 0:
+        loans = await rq.get_active_loans_page(limit=LOANS_PER_PAGE)
+    elif callback_data.direction == 'p':
+        loans = await rq.get_active_loans_page(limit=LOANS_PER_PAGE, before=cursor)
+    else:
+        loans = await rq.get_active_loans_page(limit=LOANS_PER_PAGE, after=cursor)
 
     if not loans:
         await callback.message.edit_text(
@@ -385,10 +432,9 @@ async def handle_pagination(callback: CallbackQuery):
         )
         return
 
-    total_loans = len(loans)
     await callback.message.edit_text(
         f"📊 Total Active Loans: {total_loans}\n\nSelect a loan to manage:",
-        reply_markup=loans_list_keyboard(loans, current_page=page)
+        reply_markup=loans_list_keyboard(loans, current_page=page, total_loans=total_loans)
     )
     await callback.answer()
 
@@ -403,7 +449,7 @@ async def cmd_search(message: Message):
     )
 
 
-@router.callback_query(lambda c: c.data == "search_name")
+@callbacks.on(SearchName)
 @auth_required
 async def search_by_name(callback: CallbackQuery, state: FSMContext):
     """Handle name search initiation"""
@@ -457,7 +503,7 @@ async def process_name_search(message: Message, state: FSMContext):
     await state.clear()
 
 
-@router.callback_query(lambda c: c.data == "cancel_search")
+@callbacks.on(CancelSearch)
 @auth_required
 async def cancel_search(callback: CallbackQuery, state: FSMContext):
     """Handle search cancellation"""
@@ -548,3 +594,123 @@ async def list_banned(message: Message):
         text += f"Reason: {user.reason}\n\n"
 
     await message.answer(text)
+
+
+@router.message(Command("poolstats"))
+@auth_required
+async def show_pool_stats(message: Message):
+    if not await rq.is_admin(message.from_user.id):
+        await message.answer("❌ Only authorized users can use this command.")
+        return
+
+    text = ""
+    for title, engine in (("DB Pool", get_engine()), ("Read Replica Pool", get_read_engine())):
+        if engine is None:
+            continue
+        text += f"{title}:\n\n" + "\n".join(
+            f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+            for name, value in pool_stats(engine).items()
+        ) + "\n\n"
+    await message.answer(text.strip())
+
+
+@router.message(F.document.file_name.lower().endswith(('.csv', '.jsonl')))
+@auth_required
+async def import_document(message: Message, bot: Bot):
+    """Bulk import loans from an uploaded CSV/JSONL file"""
+    if not await rq.is_admin(message.from_user.id):
+        await message.answer("❌ Only authorized users can use this command.")
+        return
+
+    status = await message.answer("📥 Importing loans...")
+    last_update = time.monotonic()
+
+    async def progress(stats):
+        nonlocal last_update
+        # Telegram rate limits message edits, so report at most every few seconds
+        if time.monotonic() - last_update < 3:
+            return
+        last_update = time.monotonic()
+        await status.edit_text(f"📥 Imported {stats['loans']} loans so far...")
+
+    with tempfile.TemporaryFile() as f:
+        await bot.download(message.document, destination=f)
+        f.seek(0)
+        stream = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+        try:
+            stats = await import_loans(
+                iter_records(stream, detect_format(message.document.file_name)),
+                progress=progress
+            )
+        except Exception as e:
+            logger.exception("Import failed: %s", e)
+            await status.edit_text(f"❌ Import failed: {e}")
+            return
+
+    text = (
+        f"✅ Import finished\n\n"
+        f"Loans: {stats['loans']}\n"
+        f"New persons: {stats['persons']}\n"
+        f"Skipped: {stats['skipped']}"
+    )
+    if stats['errors']:
+        text += "\n\n" + "\n".join(stats['errors'][:10])
+    await status.edit_text(text)
+
+
+@router.message(Command("export"))
+@auth_required
+async def export_document(message: Message):
+    """Send all loans as a CSV (default) or Parquet document: /export [csv|parquet]"""
+    if not await rq.is_admin(message.from_user.id):
+        await message.answer("❌ Only authorized users can use this command.")
+        return
+
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else 'csv'
+    if fmt not in ('csv', 'parquet'):
+        await message.answer("Usage: /export [csv|parquet]")
+        return
+
+    status = await message.answer("📤 Exporting loans...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/loans_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+        try:
+            count = await export_loans(path, fmt)
+        except Exception as e:
+            logger.exception("Export failed: %s", e)
+            await status.edit_text(f"❌ Export failed: {e}")
+            return
+
+        await message.answer_document(FSInputFile(path), caption=f"📤 {count} loans")
+    await status.delete()
+
+
+@router.message(Command("stats"))
+@auth_required
+async def show_stats(message: Message):
+    if not await rq.is_admin(message.from_user.id):
+        await message.answer("❌ Only authorized users can use this command.")
+        return
+
+    stats = await rq.get_portfolio_stats()
+
+    text = (
+        f"📈 Portfolio\n\n"
+        f"💵 Outstanding: ${stats['outstanding']:,.2f}\n"
+        f"📅 Expected weekly inflow: ${stats['weekly_inflow']:,.2f}\n"
+        f"🗓 Expected monthly inflow: ${stats['monthly_inflow']:,.2f}\n\n"
+        f"📌 By status:\n"
+    )
+    for status, count in sorted(stats['by_status'].items()):
+        text += f"  {status.title()}: {count}\n"
+    text += "\n🔄 Active by frequency:\n"
+    for frequency, count in sorted(stats['by_frequency'].items()):
+        text += f"  {frequency.title()}: {count}\n"
+    if stats['largest']:
+        text += "\n🏦 Largest exposures:\n"
+        for loan in stats['largest']:
+            text += f"  {loan['person_name']} - ${loan['remaining_amount']:,.2f}\n"
+    text += f"\nAs of {stats['computed_at']:%Y-%m-%d %H:%M:%S}"
+
+    await message.answer(text)
@@ -0,0 +1,250 @@
+"""Bulk import of loans from CSV or JSONL.
+
+Each record needs `name`, `total_amount`, `payment_frequency` and
+`number_of_payments`; `phone`, `payment_amount`, `remaining_amount`,
+`status` and `created_at` are optional. Records are streamed, persons are
+deduplicated by name (case-insensitive, like create_person) and rows are
+written in batches, one short transaction per batch.
+
+    python -m app.importer loans.csv [--format jsonl] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import math
+import time
+from datetime import datetime
+
+from sqlalchemy import select, insert, func
+
+from app.database.models import Person, Loan, async_session, dispose_engine
+from app.database.requests import loans_inserted
+from app.database.migrations import upgrade
+from app.log_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = ('weekly', 'monthly')
+STATUSES = ('active', 'completed')
+
+# Column sizes of persons.name and persons.phone
+NAME_LENGTH = 50
+PHONE_LENGTH = 15
+
+
+def detect_format(filename: str) -> str:
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def iter_records(stream, fmt: str = 'csv'):
+    """Yield raw records from a text stream without reading it all.
+
+    JSONL lines are yielded undecoded, so a malformed line is reported and
+    skipped by parse_record like any other bad record.
+    """
+    if fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield line
+    else:
+        yield from csv.DictReader(stream)
+
+
+def _amount(value, field: str) -> float:
+    # float() accepts 'nan' and 'inf', which no comparison rejects
+    amount = float(value)
+    if not math.isfinite(amount):
+        raise ValueError(f"{field} must be a finite number")
+    return amount
+
+
+def parse_record(raw: dict) -> dict:
+    """Validate a raw record (dict or JSON text), raising ValueError on bad input."""
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    if not isinstance(raw, dict):
+        raise ValueError("record is not an object")
+
+    name = (raw.get('name') or '').strip()
+    if not name:
+        raise ValueError("missing name")
+
+    total_amount = _amount(raw['total_amount'], 'total_amount')
+    number_of_payments = int(raw['number_of_payments'])
+    frequency = (raw.get('payment_frequency') or '').strip().lower()
+    if total_amount <= 0:
+        raise ValueError("total_amount must be positive")
+    if number_of_payments < 0:
+        raise ValueError("number_of_payments must not be negative")
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"payment_frequency must be one of {', '.join(FREQUENCIES)}")
+
+    payment_amount = raw.get('payment_amount')
+    if payment_amount in (None, ''):
+        payment_amount = round(total_amount / max(number_of_payments, 1), 2)
+    else:
+        payment_amount = _amount(payment_amount, 'payment_amount')
+
+    remaining_amount = raw.get('remaining_amount')
+    if remaining_amount in (None, ''):
+        remaining_amount = total_amount
+    else:
+        remaining_amount = _amount(remaining_amount, 'remaining_amount')
+    if remaining_amount < 0:
+        raise ValueError("remaining_amount must not be negative")
+
+    phone = raw.get('phone')
+    phone = str(phone).strip() if phone not in (None, '') else None
+    if phone and len(phone) > PHONE_LENGTH:
+        raise ValueError(f"phone longer than {PHONE_LENGTH} characters")
+
+    status = (raw.get('status') or '').strip().lower() or ('completed' if number_of_payments == 0 else 'active')
+    if status not in STATUSES:
+        raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+
+    created_at = raw.get('created_at')
+    return {
+        'name': name[:NAME_LENGTH],
+        'phone': phone or None,
+        'total_amount': total_amount,
+        'remaining_amount': remaining_amount,
+        'payment_frequency': frequency,
+        'number_of_payments': number_of_payments,
+        'payment_amount': payment_amount,
+        'status': status,
+        'created_at': datetime.fromisoformat(created_at) if created_at else datetime.now(),
+    }
+
+
+async def _load_person_ids() -> dict:
+    """lower(name) -> id for all existing persons, streamed in chunks."""
+    person_ids = {}
+    async with async_session() as session:
+        result = await session.stream(
+            select(func.lower(Person.name), Person.id).order_by(Person.id.desc()).execution_options(yield_per=5000)
+        )
+        async for name, person_id in result:
+            person_ids[name] = person_id
+    return person_ids
+
+
+async def _write_batch(batch: list, person_ids: dict):
+    """Insert one batch; `person_ids` only learns the new persons once the batch commits."""
+    new_persons = {}
+    new_ids = {}
+    for record in batch:
+        key = record['name'].lower()
+        if key not in person_ids and key not in new_persons:
+            new_persons[key] = {'name': record['name'], 'phone': record['phone']}
+
+    async with async_session() as session:
+        async with session.begin():
+            if new_persons:
+                result = await session.execute(
+                    insert(Person).returning(Person.id, Person.name, sort_by_parameter_order=True),
+                    list(new_persons.values())
+                )
+                for person_id, name in result:
+                    new_ids[name.lower()] = person_id
+
+            result = await session.execute(insert(Loan).returning(Loan.id, sort_by_parameter_order=True), [
+                {
+                    'person_id': person_ids.get(record['name'].lower()) or new_ids[record['name'].lower()],
+                    'total_amount': record['total_amount'],
+                    'remaining_amount': record['remaining_amount'],
+                    'payment_frequency': record['payment_frequency'],
+                    'number_of_payments': record['number_of_payments'],
+                    'payment_amount': record['payment_amount'],
+                    'status': record['status'],
+                    'created_at': record['created_at'],
+                }
+                for record in batch
+            ])
+            loan_ids = result.scalars().all()
+
+    person_ids.update(new_ids)
+    # Lets the reminder scheduler pick up imported loans without a restart
+    loans_inserted([
+        {
+            'id': loan_id,
+            'total_amount': record['total_amount'],
+            'remaining_amount': record['remaining_amount'],
+            'payment_amount': record['payment_amount'],
+            'frequency': record['payment_frequency'],
+            'status': record['status'],
+            'created_at': record['created_at'],
+        }
+        for loan_id, record in zip(loan_ids, batch)
+    ])
+    return len(new_persons)
+
+
+async def import_loans(records, batch_size: int = 1000, progress=None) -> dict:
+    """Import raw records; `progress` is an optional async callback taking the stats dict."""
+    stats = {'loans': 0, 'persons': 0, 'skipped': 0, 'errors': []}
+    person_ids = await _load_person_ids()
+
+    batch = []
+    for line_number, raw in enumerate(records, start=1):
+        try:
+            batch.append(parse_record(raw))
+        except (KeyError, ValueError, TypeError) as e:
+            stats['skipped'] += 1
+            if len(stats['errors']) < 20:
+                stats['errors'].append(f"record {line_number}: {e}")
+            continue
+
+        if len(batch) >= batch_size:
+            stats['persons'] += await _write_batch(batch, person_ids)
+            stats['loans'] += len(batch)
+            batch = []
+            if progress:
+                await progress(stats)
+
+    if batch:
+        stats['persons'] += await _write_batch(batch, person_ids)
+        stats['loans'] += len(batch)
+        if progress:
+            await progress(stats)
+
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk import loans from CSV or JSONL")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'jsonl'))
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    await upgrade()
+
+    started = time.perf_counter()
+
+    async def progress(stats):
+        logger.info("Imported %s loans (%s new persons)", stats['loans'], stats['persons'])
+
+    try:
+        with open(args.path, encoding='utf-8-sig', newline='') as f:
+            stats = await import_loans(
+                iter_records(f, args.format or detect_format(args.path)),
+                batch_size=args.batch_size,
+                progress=progress
+            )
+    finally:
+        # aiosqlite keeps a worker thread per connection that would block interpreter exit
+        await dispose_engine()
+
+    for error in stats['errors']:
+        logger.warning(error)
+    logger.info(
+        "Done in %.1fs: %s loans, %s new persons, %s skipped",
+        time.perf_counter() - started, stats['loans'], stats['persons'], stats['skipped']
+    )
+
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(main())
@@ -5,6 +5,11 @@ from aiogram.types import (
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 
+from app.callbacks import (
+    SelectFrequency, ConfirmLoan, AdjustPayments, BackToLoans, ViewLoan, LoanHistory,
+    Page, PageInfo, SearchName, CancelSearch
+)
+
 
 # Main menu keyboard
 def main():
@@ -26,8 +31,8 @@ def cancel_kb():
 def frequency_kb():
     keyboard = InlineKeyboardBuilder()
     keyboard.add(
-        InlineKeyboardButton(text="Weekly", callback_data="freq_weekly"),
-        InlineKeyboardButton(text="Monthly", callback_data="freq_monthly")
+        InlineKeyboardButton(text="Weekly", callback_data=SelectFrequency("weekly").pack()),
+        InlineKeyboardButton(text="Monthly", callback_data=SelectFrequency("monthly").pack())
     )
     return keyboard.adjust(2).as_markup()
 
@@ -36,8 +41,8 @@ def frequency_kb():
 def confirm_keyboard():
     keyboard = InlineKeyboardBuilder()
     keyboard.add(
-        InlineKeyboardButton(text="✅ Confirm", callback_data="confirm_loan"),
-        InlineKeyboardButton(text="❌ Cancel", callback_data="cancel_loan")
+        InlineKeyboardButton(text="✅ Confirm", callback_data=ConfirmLoan(True).pack()),
+        InlineKeyboardButton(text="❌ Cancel", callback_data=ConfirmLoan(False).pack())
     )
     return keyboard.adjust(2).as_markup()
 
@@ -47,48 +52,69 @@ def loan_details_keyboard(loan_id: int):
     keyboard.add(
         InlineKeyboardButton(
             text="➖ Remove Payment",
-            callback_data=f"decrease_{loan_id}"
+            callback_data=AdjustPayments(loan_id, -1).pack()
         ),
         InlineKeyboardButton(
             text="➕ Add Payment",
-            callback_data=f"increase_{loan_id}"
+            callback_data=AdjustPayments(loan_id, 1).pack()
         ),
     )
     keyboard.add(
+        InlineKeyboardButton(
+            text="📜 History",
+            callback_data=LoanHistory(loan_id).pack()
+        ),
         InlineKeyboardButton(
             text="🔙 Back to Loans",
-            callback_data="back_to_loans"
+            callback_data=BackToLoans().pack()
         )
     )
     return keyboard.adjust(2).as_markup()
 
 
-def loans_list_keyboard(loans, current_page=0, loans_per_page=5):
+def loan_history_keyboard(loan_id: int):
     keyboard = InlineKeyboardBuilder()
+    keyboard.add(
+        InlineKeyboardButton(
+            text="🔙 Back to Loan",
+            callback_data=ViewLoan(loan_id).pack()
+        )
+    )
+    return keyboard.adjust(1).as_markup()
 
-    start_idx = current_page * loans_per_page
-    end_idx = start_idx + loans_per_page
-    page_loans = loans[start_idx:end_idx]
-    total_pages = (len(loans) + loans_per_page - 1) // loans_per_page
 
-    for loan in page_loans:
+def loans_list_keyboard(loans, current_page=0, total_loans=None, loans_per_page=5):
+    """Build the loans list keyboard.
+
+    `loans` is already the page to show. When `total_loans` is given the
+    navigation buttons carry a keyset cursor of the first/last loan, otherwise
+    the loans are shown as a plain list (e.g. search results).
+    """
+    keyboard = InlineKeyboardBuilder()
+
+    for loan in loans:
         button_text = f"{loan['person_name']} - ${loan['remaining_amount']:,.2f}"
         keyboard.add(InlineKeyboardButton(
             text=button_text,
-            callback_data=f"view_loan_{loan['id']}"
+            callback_data=ViewLoan(loan['id']).pack()
         ))
 
+    if total_loans is None or not loans:
+        return keyboard.adjust(1).as_markup()
+
+    total_pages = (total_loans + loans_per_page - 1) // loans_per_page
+
     nav_buttons = []
     if current_page > 0:
         nav_buttons.append(InlineKeyboardButton(
             text="◀️ Previous",
-            callback_data=f"page_{current_page - 1}"
+            callback_data=Page(current_page - 1, 'p', loans[0]['created_at'], loans[0]['id']).pack()
         ))
 
     if current_page < total_pages - 1:
         nav_buttons.append(InlineKeyboardButton(
             text="Next ▶️",
-            callback_data=f"page_{current_page + 1}"
+            callback_data=Page(current_page + 1, 'n', loans[-1]['created_at'], loans[-1]['id']).pack()
         ))
 
     if nav_buttons:
@@ -96,7 +122,7 @@ def loans_list_keyboard(loans, current_page=0, loans_per_page=5):
 
     keyboard.row(InlineKeyboardButton(
         text=f"Page {current_page + 1} of {total_pages}",
-        callback_data="page_info"
+        callback_data=PageInfo().pack()
     ))
 
     return keyboard.adjust(1).as_markup()
@@ -105,7 +131,7 @@ def loans_list_keyboard(loans, current_page=0, loans_per_page=5):
 def search_filters_keyboard():
     keyboard = InlineKeyboardBuilder()
     keyboard.add(
-        InlineKeyboardButton(text="🔍 Search by Name", callback_data="search_name")
+        InlineKeyboardButton(text="🔍 Search by Name", callback_data=SearchName().pack())
         # InlineKeyboardButton(text="💰 Search by Amount", callback_data="search_amount"),
         # InlineKeyboardButton(text="📅 Search by Date", callback_data="search_date"),
         # InlineKeyboardButton(text="📊 Status", callback_data="search_status")
@@ -117,6 +143,6 @@ def search_filters_keyboard():
 def inline_cancel_kb():
     keyboard = InlineKeyboardBuilder()
     keyboard.add(
-        InlineKeyboardButton(text="❌ Cancel", callback_data="cancel_search")
+        InlineKeyboardButton(text="❌ Cancel", callback_data=CancelSearch().pack())
     )
     return keyboard.adjust(1).as_markup()
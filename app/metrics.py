@@ -0,0 +1,170 @@
+"""Minimal Prometheus metrics: histograms and counters rendered in the text
+exposition format, plus the hooks that feed them."""
+import re
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}"
+
+
+def render_metrics() -> str:
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+handler_latency = Histogram(
+    'bot_handler_duration_seconds', 'Time spent in update handlers', ('event', 'handler')
+)
+handler_errors = Counter(
+    'bot_handler_errors_total', 'Exceptions raised by update handlers', ('event', 'handler')
+)
+db_query_latency = Histogram(
+    'bot_db_query_duration_seconds', 'Database statement execution time', ('statement',)
+)
+telegram_latency = Histogram(
+    'bot_telegram_request_duration_seconds', 'Bot API request time', ('method',)
+)
+telegram_errors = Counter(
+    'bot_telegram_request_errors_total', 'Failed Bot API requests', ('method',)
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware timing every handler by event type and function name."""
+
+    async def __call__(self, handler, event, data):
+        callback = getattr(data.get('handler'), 'callback', None)
+        # Handlers that dispatch further (app.callbacks.CallbackRouter) name their target
+        resolve = getattr(getattr(callback, '__self__', None), 'handler_name', None)
+        name = resolve(event) if resolve else getattr(callback, '__name__', 'unknown')
+        labels = (type(event).__name__, name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(*labels)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, *labels)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware timing outbound API calls (answer, edit_text, getUpdates...)."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_errors.inc(name)
+            raise
+        finally:
+            telegram_latency.observe(time.perf_counter() - started, name)
+
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\$\d+|%\(\w+\)s|:\w+")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+_SELECT_LIST_RE = re.compile(r"^SELECT .+? FROM ", re.IGNORECASE)
+_RETURNING_RE = re.compile(r" RETURNING .*$", re.IGNORECASE)
+
+
+def statement_fingerprint(statement: str) -> str:
+    """Normalize a SQL statement so queries differing only in values share a label."""
+    fingerprint = _LITERAL_RE.sub('?', statement)
+    fingerprint = _SPACE_RE.sub(' ', fingerprint).strip()
+    fingerprint = _LIST_RE.sub('(...)', fingerprint)
+    # Column lists make labels long without telling queries apart
+    fingerprint = _SELECT_LIST_RE.sub('SELECT ... FROM ', fingerprint)
+    fingerprint = _RETURNING_RE.sub(' RETURNING ...', fingerprint)
+    return fingerprint[:300]
+
+
+def instrument_engine(engine):
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        db_query_latency.observe(time.perf_counter() - started, statement_fingerprint(statement))
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('query_started'):
+            conn.info['query_started'].pop()
+
+
+async def metrics_handler(request: web.Request):
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
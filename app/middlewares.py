@@ -0,0 +1,16 @@
+from aiogram import BaseMiddleware
+
+from app.database.models import current_user
+
+
+class DatabaseRoutingMiddleware(BaseMiddleware):
+    """Outer update middleware exposing the acting user to the database layer,
+    so a user's reads follow their own writes to the primary."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        token = current_user.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_user.reset(token)
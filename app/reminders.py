@@ -0,0 +1,147 @@
+"""Payment due-date reminders.
+
+Every active loan's next due date lives in a min-heap. A single task sleeps
+until the earliest one, queues a reminder to authorized users and schedules the loan's
+following period. Loan changes re-schedule just that loan through
+rq.loan_listeners; superseded heap entries are skipped when they surface.
+"""
+import asyncio
+import calendar
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import app.database.requests as rq
+from app.callbacks import ViewLoan
+from app.sender import MessageSender, NORMAL
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on one sleep, so wall-clock changes are noticed
+MAX_SLEEP = 3600
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    month = moment.month - 1 + months
+    year = moment.year + month // 12
+    month = month % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+def due_date(created_at: datetime, frequency: str, period: int) -> datetime:
+    """When the `period`-th payment (1-based) of a loan falls due"""
+    if frequency == 'weekly':
+        return created_at + timedelta(weeks=period)
+    return add_months(created_at, period)
+
+
+def payments_made(loan: dict) -> int:
+    if not loan['payment_amount']:
+        return 0
+    paid = loan['total_amount'] - loan['remaining_amount']
+    return max(0, round(paid / loan['payment_amount']))
+
+
+class ReminderScheduler:
+    def __init__(self, sender: MessageSender):
+        self.sender = sender
+        self._heap = []  # (due, loan_id, period)
+        self._scheduled = {}  # loan_id -> (due, period, created_at, frequency) of its live entry
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def schedule(self, loan: dict, now: datetime = None):
+        """(Re)schedule a loan from its current state; inactive loans are dropped"""
+        if loan['status'] != 'active':
+            self._scheduled.pop(loan['id'], None)
+            return
+
+        now = now or datetime.now()
+        period = payments_made(loan) + 1
+        due = due_date(loan['created_at'], loan['frequency'], period)
+        # An overdue loan is reminded again at each following period, not right away
+        while due < now:
+            period += 1
+            due = due_date(loan['created_at'], loan['frequency'], period)
+
+        self._push(loan['id'], due, period, loan['created_at'], loan['frequency'])
+
+    def _push(self, loan_id: int, due: datetime, period: int, created_at: datetime, frequency: str):
+        self._scheduled[loan_id] = (due, period, created_at, frequency)
+        entry = (due, loan_id, period)
+        heapq.heappush(self._heap, entry)
+
+        # Rebuild once superseded entries dominate the heap
+        if len(self._heap) > 2 * len(self._scheduled) + 64:
+            self._heap = [(due, loan_id, period) for loan_id, (due, period, *_) in self._scheduled.items()]
+            heapq.heapify(self._heap)
+
+        if self._heap[0] == entry:
+            self._wakeup.set()
+
+    def _is_live(self, entry) -> bool:
+        due, loan_id, period = entry
+        scheduled = self._scheduled.get(loan_id)
+        return scheduled is not None and scheduled[:2] == (due, period)
+
+    async def start(self):
+        for loan in await rq.get_loan_schedules():
+            self.schedule(loan)
+        rq.loan_listeners.append(self.schedule)
+        self._task = asyncio.create_task(self.run())
+        logger.info("Reminder scheduler started with %s active loans", len(self))
+
+    async def run(self):
+        while True:
+            while self._heap and not self._is_live(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = (self._heap[0][0] - datetime.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due, loan_id, period = heapq.heappop(self._heap)
+            _, _, created_at, frequency = self._scheduled.pop(loan_id)
+            try:
+                await self._remind(loan_id, due)
+            except Exception as e:
+                logger.error("Reminder for loan %s failed: %s", loan_id, e)
+
+            # Unless the loan changed while we were sending, move on to its next period
+            if loan_id not in self._scheduled:
+                self._push(loan_id, due_date(created_at, frequency, period + 1),
+                           period + 1, created_at, frequency)
+
+    async def _remind(self, loan_id: int, due: datetime):
+        loan = await rq.get_loan_details(loan_id)
+        if not loan or loan['status'] != 'active':
+            return
+
+        text = (
+            f"⏰ Payment due\n\n"
+            f"👤 {loan['person_name']}\n"
+            f"💵 ${loan['payment_amount']:,.2f} ({loan['frequency']})\n"
+            f"📅 Due: {due:%Y-%m-%d}\n"
+            f"💰 Remaining: ${loan['remaining_amount']:,.2f}"
+        )
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="View loan", callback_data=ViewLoan(loan_id).pack())
+        ]])
+
+        users = await rq.get_authorized_users()
+        self.sender.broadcast([user.tg_id for user in users], text, NORMAL, reply_markup=keyboard)
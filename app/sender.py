@@ -0,0 +1,214 @@
+"""Outbound message queue that stays inside Telegram's rate limits.
+
+Bulk traffic (reminders, reports, notices) is submitted here instead of
+looping over bot.send_message. Jobs wait in priority lanes and go out under
+a global token bucket and a minimum interval per chat; a RetryAfter pauses
+the whole queue for the time Telegram asks and re-queues the job.
+
+Handler replies don't go through the queue. OutboundRateMiddleware charges
+them to the same bucket, so queued sends back off while the bot is busy
+answering users but a reply never waits for a broadcast.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lowest value goes first
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+
+# Telegram allows about one message per second in a private chat and 20 a minute in a group
+CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+# Methods that count towards Telegram's message limits
+_CHARGED_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+
+# Set while the queue itself is calling the API, so the middleware doesn't charge twice
+_queued_call = ContextVar('queued_call', default=False)
+
+
+class TokenBucket:
+    """Token bucket that can go into debt when untracked sends are charged to it."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def charge(self, amount: float = 1.0):
+        self._refill()
+        self.tokens -= amount
+
+    def wait_time(self) -> float:
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class MessageSender:
+    def __init__(self, bot: Bot, rate: float = 25, chat_interval: float = CHAT_INTERVAL,
+                 concurrency: int = 8, max_retries: int = 3):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        # One heap per lane of (ready_at, seq, chat_id, method, future, attempts, lane)
+        self._lanes = [[] for _ in (INTERACTIVE, NORMAL, BULK)]
+        self._seq = itertools.count()
+        self._chat_ready = {}  # chat_id -> monotonic time the chat may get its next message
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._task = None
+        self._deliveries = set()  # the event loop only keeps weak references to tasks
+
+    def __len__(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def submit(self, method: TelegramMethod, priority: int = NORMAL) -> asyncio.Future:
+        """Queue any Bot API method; the future resolves to its result"""
+        future = asyncio.get_running_loop().create_future()
+        # Failures are logged by _deliver, callers may fire and forget
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._enqueue(priority, method, future, 0, time.monotonic())
+        return future
+
+    def send_message(self, chat_id: int, text: str, priority: int = NORMAL, **kwargs) -> asyncio.Future:
+        return self.submit(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def broadcast(self, chat_ids, text: str, priority: int = BULK, **kwargs) -> list:
+        return [self.send_message(chat_id, text, priority, **kwargs) for chat_id in chat_ids]
+
+    def note_chat(self, chat_id: int):
+        """Record a message sent outside the queue so the chat's pacing accounts for it"""
+        ready_at = time.monotonic() + self._interval(chat_id)
+        self._chat_ready[chat_id] = max(self._chat_ready.get(chat_id, 0.0), ready_at)
+
+    def _interval(self, chat_id) -> float:
+        if isinstance(chat_id, int) and chat_id < 0:
+            return max(self.chat_interval, GROUP_CHAT_INTERVAL)
+        return self.chat_interval
+
+    def _enqueue(self, lane: int, method: TelegramMethod, future: asyncio.Future,
+                 attempts: int, ready_at: float):
+        chat_id = getattr(method, 'chat_id', None)
+        heapq.heappush(self._lanes[lane], (ready_at, next(self._seq), chat_id, method, future, attempts, lane))
+        self._wakeup.set()
+
+    def _pop_ready(self, now: float):
+        """Highest-priority job whose chat may be messaged now, else when the next one will be"""
+        next_ready = None
+        for lane in self._lanes:
+            while lane:
+                ready_at, seq, chat_id, *job = lane[0]
+                chat_ready = self._chat_ready.get(chat_id, 0.0)
+                if chat_ready > ready_at:
+                    # The chat got a message since this job was queued
+                    heapq.heapreplace(lane, (chat_ready, seq, chat_id, *job))
+                    continue
+                if ready_at <= now:
+                    return heapq.heappop(lane), None
+                if next_ready is None or ready_at < next_ready:
+                    next_ready = ready_at
+                break
+        return None, next_ready
+
+    async def _sleep(self, delay):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            job, next_ready = self._pop_ready(now)
+            if job is None:
+                await self._sleep(None if next_ready is None else next_ready - now)
+                continue
+
+            wait = self.bucket.wait_time()
+            if wait > 0:
+                # Put it back: a higher lane may fill up while we wait
+                heapq.heappush(self._lanes[job[-1]], job)
+                await self._sleep(wait)
+                continue
+
+            chat_id = job[2]
+            if chat_id is not None:
+                self._chat_ready[chat_id] = now + self._interval(chat_id)
+                if len(self._chat_ready) > 10000:
+                    self._chat_ready = {key: ready for key, ready in self._chat_ready.items() if ready > now}
+            self.bucket.charge()
+
+            await self._slots.acquire()
+            delivery = asyncio.create_task(self._deliver(job))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, job):
+        _, _, chat_id, method, future, attempts, lane = job
+        _queued_call.set(True)
+        try:
+            result = await self.bot(method)
+        except TelegramRetryAfter as e:
+            if attempts >= self.max_retries:
+                logger.warning("Giving up on %s to %s after %s retries", type(method).__name__, chat_id, attempts)
+                if not future.done():
+                    future.set_exception(e)
+                return
+            resume = time.monotonic() + e.retry_after
+            self._paused_until = max(self._paused_until, resume)
+            logger.warning("Flood control hit, pausing outbound queue for %ss", e.retry_after)
+            self._enqueue(lane, method, future, attempts + 1, resume)
+        except Exception as e:
+            logger.warning("Could not deliver %s to %s: %s", type(method).__name__, chat_id, e)
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._slots.release()
+
+
+class OutboundRateMiddleware(BaseRequestMiddleware):
+    """Bot session middleware charging direct API sends (handler replies) to the queue's limits."""
+
+    def __init__(self, sender: MessageSender):
+        self.sender = sender
+
+    async def __call__(self, make_request, bot, method):
+        if not _queued_call.get() and type(method).__name__.startswith(_CHARGED_PREFIXES):
+            self.sender.bucket.charge()
+            chat_id = getattr(method, 'chat_id', None)
+            if chat_id is not None:
+                self.sender.note_chat(chat_id)
+        return await make_request(bot, method)
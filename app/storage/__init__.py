@@ -0,0 +1,32 @@
+import os
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.storage.buffered import BufferedStorage
+from app.storage.sql import SQLStorage
+
+
+def create_storage() -> BaseStorage:
+    """Build the FSM storage selected by FSM_STORAGE (memory, sql or redis)."""
+    backend = os.getenv('FSM_STORAGE', 'memory').lower()
+    ttl = int(os.getenv('FSM_TTL', 86400))
+    flush_interval = float(os.getenv('FSM_FLUSH_INTERVAL', 0.1))
+
+    if backend == 'memory':
+        return MemoryStorage()
+
+    if backend == 'sql':
+        return BufferedStorage(SQLStorage(ttl=ttl), flush_interval=flush_interval)
+
+    if backend == 'redis':
+        # Needs the redis package, only imported when selected
+        from app.storage.redis_storage import PipelinedRedisStorage
+        storage = PipelinedRedisStorage.from_url(
+            os.getenv('FSM_REDIS_URL', 'redis://localhost:6379/0'),
+            state_ttl=ttl,
+            data_ttl=ttl
+        )
+        return BufferedStorage(storage, flush_interval=flush_interval)
+
+    raise ValueError(f"Unknown FSM_STORAGE backend: {backend}")
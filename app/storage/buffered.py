@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedStorage(BaseStorage):
+    """Write-behind buffer in front of a batching storage.
+
+    `set_state` / `set_data` calls (including the get+set done by
+    `state.update_data`) land in memory and are flushed together every
+    `flush_interval` seconds through the wrapped storage's `write_many`, so a
+    handler that updates data and state costs one write instead of several.
+    Reads see pending writes first, then the batch being flushed, so nothing
+    falls back to the stale backend value while `write_many` is running.
+    """
+
+    def __init__(self, storage: BaseStorage, flush_interval: float = 0.1):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self._pending: Dict[StorageKey, Dict[str, Any]] = {}
+        self._in_flight: Dict[StorageKey, Dict[str, Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _buffer(self, key: StorageKey, field: str, value: Any):
+        self._pending.setdefault(key, {})[field] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _buffered(self, key: StorageKey, field: str):
+        """(True, value) if a pending or in-flight write holds `field` for `key`"""
+        for records in (self._pending, self._in_flight):
+            record = records.get(key)
+            if record is not None and field in record:
+                return True, record[field]
+        return False, None
+
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # logged in flush(), retried on the next tick
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        records, self._pending = self._pending, {}
+        self._in_flight = records
+        try:
+            await self.storage.write_many(records)
+        except (Exception, asyncio.CancelledError) as e:
+            logger.error("Failed to flush %s FSM records: %r", len(records), e)
+            # Keep the failed writes unless they were overwritten meanwhile
+            for key, record in records.items():
+                self._pending[key] = {**record, **self._pending.get(key, {})}
+            raise
+        finally:
+            self._in_flight = {}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._buffer(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        found, state = self._buffered(key, 'state')
+        if found:
+            return state
+        return await self.storage.get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._buffer(key, 'data', data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        found, data = self._buffered(key, 'data')
+        if found:
+            return data.copy()
+        return await self.storage.get_data(key)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flush_task
+        await self.flush()
+        await self.storage.close()
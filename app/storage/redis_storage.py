@@ -0,0 +1,28 @@
+from typing import Any, Dict
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+
+class PipelinedRedisStorage(RedisStorage):
+    """aiogram's RedisStorage with a `write_many` that sends every buffered
+    state/data write in one pipeline round trip, keeping the TTLs."""
+
+    async def write_many(self, records: Dict[StorageKey, Dict[str, Any]]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, record in records.items():
+                if 'state' in record:
+                    state_key = self.key_builder.build(key, 'state')
+                    if record['state'] is None:
+                        pipe.delete(state_key)
+                    else:
+                        pipe.set(state_key, record['state'], ex=self.state_ttl)
+
+                if 'data' in record:
+                    data_key = self.key_builder.build(key, 'data')
+                    if not record['data']:
+                        pipe.delete(data_key)
+                    else:
+                        pipe.set(data_key, self.json_dumps(record['data']), ex=self.data_ttl)
+
+            await pipe.execute()
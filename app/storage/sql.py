@@ -0,0 +1,86 @@
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StorageKey, StateType
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.models import FsmRecord, async_session, get_engine
+
+
+class SQLStorage(BaseStorage):
+    """FSM storage in the fsm_storage table of the bot database.
+
+    Records expire `ttl` seconds after their last write; expired rows are
+    ignored on read and purged at most every `purge_interval` seconds.
+    """
+
+    def __init__(self, ttl: float = 86400, purge_interval: float = 600,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.ttl = timedelta(seconds=ttl)
+        self.purge_interval = purge_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._last_purge = time.monotonic()
+
+    async def _get(self, key: StorageKey) -> Optional[FsmRecord]:
+        async with async_session() as session:
+            return await session.scalar(
+                select(FsmRecord).where(
+                    FsmRecord.key == self.key_builder.build(key),
+                    FsmRecord.expires_at > datetime.now()
+                )
+            )
+
+    async def write_many(self, records: Dict[StorageKey, Dict[str, Any]]):
+        """Upsert several records in one transaction.
+
+        Each record holds 'state' and/or 'data'; missing fields are left as
+        they are. Rows are grouped by the fields they set so every group is a
+        single multi-row INSERT ... ON CONFLICT.
+        """
+        insert = pg_insert if get_engine().dialect.name == 'postgresql' else sqlite_insert
+        expires_at = datetime.now() + self.ttl
+
+        groups = {}
+        for key, record in records.items():
+            row = {'key': self.key_builder.build(key), 'expires_at': expires_at, **record}
+            groups.setdefault(tuple(sorted(record)), []).append(row)
+
+        async with async_session() as session:
+            async with session.begin():
+                for fields, rows in groups.items():
+                    query = insert(FsmRecord).values(rows)
+                    query = query.on_conflict_do_update(
+                        index_elements=[FsmRecord.key],
+                        set_={
+                            field: query.excluded[field]
+                            for field in (*fields, 'expires_at')
+                        }
+                    )
+                    await session.execute(query)
+
+                if time.monotonic() - self._last_purge > self.purge_interval:
+                    await session.execute(
+                        delete(FsmRecord).where(FsmRecord.expires_at <= datetime.now())
+                    )
+                    self._last_purge = time.monotonic()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.write_many({key: {'state': state.state if isinstance(state, State) else state}})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.write_many({key: {'data': data}})
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get(key)
+        return dict(record.data or {}) if record else {}
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,193 @@
+"""Benchmarks for app/database/requests.py.
+
+Seeds synthetic persons and loans into a scratch database, times the request
+functions at several dataset sizes and concurrency levels and writes the
+results as JSON so runs can be compared between commits:
+
+    python -m benchmarks.bench_requests --sizes 10000,100000 --concurrency 1,10,50 \\
+        --output bench.json
+
+The target database is dropped and recreated for every size. It is taken from
+--database-url (default: a local SQLite file, sqlite+aiosqlite:///:memory:
+skips the disk entirely), never from DATABASE_URL.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ['John', 'Jane', 'Mark', 'Maria', 'David', 'Sarah', 'Michael', 'Anna', 'Daniel', 'Olga',
+               'Yosef', 'Noa', 'Ahmed', 'Lena', 'Ivan', 'Chen', 'Lucas', 'Sofia', 'Omar', 'Emma']
+LAST_NAMES = ['Smith', 'Cohen', 'Levi', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Taylor',
+              'Katz', 'Friedman', 'Petrov', 'Wang', 'Silva', 'Haddad', 'Novak', 'Schmidt', 'Rossi', 'Kim']
+
+SEED_BATCH = 10000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite+aiosqlite:///bench.db')
+    parser.add_argument('--sizes', default='10000,100000', help='comma separated loan counts')
+    parser.add_argument('--concurrency', default='1,10,50', help='comma separated concurrency levels')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per benchmark and concurrency')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='-', help="JSON output file, '-' for stdout")
+    return parser.parse_args()
+
+
+def random_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.randrange(100000)}"
+
+
+async def seed(size: int, rng):
+    """Insert `size` persons with one loan each and a few authorized users."""
+    from sqlalchemy import insert
+    from app.database.models import Person, Loan, User, async_session
+
+    started = datetime.now() - timedelta(days=365)
+    async with async_session() as session:
+        async with session.begin():
+            for offset in range(0, size, SEED_BATCH):
+                count = min(SEED_BATCH, size - offset)
+                await session.execute(insert(Person), [
+                    {'id': offset + i + 1, 'name': random_name(rng), 'created_at': started}
+                    for i in range(count)
+                ])
+                await session.execute(insert(Loan), [
+                    {
+                        'id': offset + i + 1,
+                        'person_id': offset + i + 1,
+                        'total_amount': 1000.0,
+                        'remaining_amount': 500.0,
+                        'payment_frequency': rng.choice(('weekly', 'monthly')),
+                        'number_of_payments': 5,
+                        'payment_amount': 100.0,
+                        'created_at': started + timedelta(seconds=offset + i),
+                        'status': 'active' if rng.random() < 0.8 else 'completed'
+                    }
+                    for i in range(count)
+                ])
+            await session.execute(insert(User), [
+                {'tg_id': tg_id, 'is_authorized': True} for tg_id in range(1, 101)
+            ])
+
+
+def benchmarks(size: int, rng):
+    """name -> zero-argument coroutine factory"""
+    from app.database import requests as rq
+
+    async def is_user_authorized_uncached():
+        rq.auth_cache.clear()
+        await rq.is_user_authorized(rng.randint(1, 200))
+
+    async def create_person_and_loan():
+        person = await rq.create_person(random_name(rng))
+        await rq.create_loan(person['id'], 1000.0, 'weekly', 10, 100.0)
+
+    return {
+        'get_all_loans': lambda: rq.get_all_loans(),
+        'get_active_loans_page': lambda: rq.get_active_loans_page(limit=5),
+        'count_active_loans': lambda: rq.count_active_loans(),
+        'search_loans_by_name': lambda: rq.search_loans_by_name(
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        ),
+        'get_loan_details': lambda: rq.get_loan_details(rng.randint(1, size)),
+        'update_loan_payment_details': lambda: rq.update_loan_payment_details(rng.randint(1, size), 5),
+        'adjust_loan_payments': lambda: rq.adjust_loan_payments(rng.randint(1, size), rng.choice((1, -1))),
+        'is_user_authorized': lambda: rq.is_user_authorized(rng.randint(1, 200)),
+        'is_user_authorized_uncached': is_user_authorized_uncached,
+        'create_person_and_loan': create_person_and_loan,
+    }
+
+
+async def run_benchmark(factory, iterations: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def call():
+        async with semaphore:
+            started = time.perf_counter()
+            await factory()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(iterations)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'ops_per_sec': iterations / elapsed,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': quantiles[49] * 1000,
+        'p95_ms': quantiles[94] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    from app.database.models import configure, dispose_engine, recreate_tables
+    from app.database.migrations import upgrade
+
+    engine = configure(args.database_url)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    levels = [int(level) for level in args.concurrency.split(',')]
+    report = {
+        'commit': git_commit(),
+        'started_at': datetime.now().isoformat(),
+        'dialect': engine.dialect.name,
+        'python': platform.python_version(),
+        'results': []
+    }
+
+    for size in sizes:
+        rng = random.Random(args.seed)
+        await recreate_tables()
+        await upgrade()
+
+        seed_started = time.perf_counter()
+        await seed(size, rng)
+        print(f"Seeded {size} loans in {time.perf_counter() - seed_started:.1f}s", file=sys.stderr)
+
+        for name, factory in benchmarks(size, rng).items():
+            for concurrency in levels:
+                # Full table reads get slow on big datasets, keep them short
+                iterations = max(concurrency, args.iterations // 10) if name == 'get_all_loans' else args.iterations
+                result = await run_benchmark(factory, iterations, concurrency)
+                result.update(name=name, size=size)
+                report['results'].append(result)
+                print(f"{name:32} size={size:<8} c={concurrency:<4} "
+                      f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+                      f"{result['ops_per_sec']:.0f} ops/s", file=sys.stderr)
+
+    await dispose_engine()
+    return report
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = asyncio.run(main(args))
+
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
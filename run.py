@@ -3,34 +3,149 @@ import os
 import asyncio
 
 from dotenv import load_dotenv
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 from app.handlers import router as user_router
-from app.database.models import async_main
+from app.log_config import setup_logging
+from app.storage import create_storage
+from app.database.migrations import upgrade
+from app.database.requests import load_banned_users, refresh_banned_users
+from app.database.models import configure, get_read_engine
+from app.database.pool import log_pool_stats
+from app.reminders import ReminderScheduler
+from app.sender import MessageSender, OutboundRateMiddleware
+from app.middlewares import DatabaseRoutingMiddleware
+from app.metrics import (
+    HandlerMetricsMiddleware, TelegramMetricsMiddleware, instrument_engine, metrics_handler
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def healthz(request: web.Request):
+    return web.Response(text='ok')
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    webhook_path = os.getenv('WEBHOOK_PATH', '/webhook')
+    webhook_url = os.getenv('WEBHOOK_URL', '').rstrip('/') + webhook_path
+    secret = os.getenv('WEBHOOK_SECRET')
+
+    async def on_startup():
+        # Every replica registers the same URL, so this is safe to repeat
+        await bot.set_webhook(webhook_url, secret_token=secret, allowed_updates=dp.resolve_used_update_types())
+
+    dp.startup.register(on_startup)
+
+    app = web.Application()
+    # Answer Telegram right away and process each update in its own task
+    SimpleRequestHandler(dp, bot, handle_in_background=True, secret_token=secret).register(app, path=webhook_path)
+    app.router.add_get('/healthz', healthz)
+    app.router.add_get('/metrics', metrics_handler)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, os.getenv('WEBHOOK_HOST', '0.0.0.0'), int(os.getenv('WEBHOOK_PORT', 8080)))
+    await site.start()
+    logger.info("Webhook server listening for %s", webhook_url)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """Standalone /metrics endpoint for polling mode"""
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, os.getenv('METRICS_HOST', '0.0.0.0'), port).start()
+    logger.info("Metrics available on port %s", port)
+    return runner
 
 
 async def main():
     # Load environment variables
     load_dotenv()
 
+    # Fail before connecting anywhere if webhook mode has nowhere to register
+    webhook_mode = os.getenv('BOT_MODE', 'polling').lower() == 'webhook'
+    if webhook_mode and not os.getenv('WEBHOOK_URL', '').startswith('https://'):
+        raise SystemExit(
+            "BOT_MODE=webhook needs WEBHOOK_URL set to the bot's public https:// base URL, "
+            "e.g. WEBHOOK_URL=https://bot.example.com"
+        )
+
     # Initialize bot and dispatcher
-    storage = MemoryStorage()
+    storage = create_storage()
     bot = Bot(token=os.getenv('TOKEN'))
     dp = Dispatcher(storage=storage)
 
-    # Create database tables
-    await async_main()
+    # Connect to DATABASE_URL, and DATABASE_READ_URL for reads when set
+    engine = configure()
+    read_engine = get_read_engine()
+
+    # Apply pending schema migrations; a no-op version check when already current
+    await upgrade()
+
+    # Load the ban list into memory for rate_limit checks, and pick up other processes' changes
+    await load_banned_users()
+    # Held here for the bot's lifetime: the event loop only keeps weak references to tasks
+    background_tasks = [
+        asyncio.create_task(refresh_banned_users(float(os.getenv('BAN_REFRESH_INTERVAL', 30))))
+    ]
+
+    # Periodically log connection pool usage
+    pool_log_interval = float(os.getenv('DB_POOL_LOG_INTERVAL', 0))
+    if pool_log_interval > 0:
+        for pooled_engine in filter(None, (engine, read_engine)):
+            background_tasks.append(asyncio.create_task(log_pool_stats(pooled_engine, pool_log_interval)))
+
+    # Rate-limited queue for bulk sends; handler replies are charged to it as they go out
+    sender = MessageSender(
+        bot,
+        rate=float(os.getenv('OUTBOUND_RATE', 25)),
+        chat_interval=float(os.getenv('OUTBOUND_CHAT_INTERVAL', 1))
+    )
+    bot.session.middleware(OutboundRateMiddleware(sender))
+    sender.start()
+
+    # Payment due-date reminders for authorized users
+    if os.getenv('REMINDERS', 'false').lower() == 'true':
+        await ReminderScheduler(sender).start()
+
+    # Handler, Bot API and query latency metrics
+    for instrumented_engine in filter(None, (engine, read_engine)):
+        instrument_engine(instrumented_engine)
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+    # Route the acting user's reads to the primary right after their writes
+    dp.update.outer_middleware(DatabaseRoutingMiddleware())
 
     # Include routers
     dp.include_router(user_router)
 
-    # Start polling
-    await dp.start_polling(bot, storage=storage)
+    if webhook_mode:
+        await run_webhook(dp, bot)
+    else:
+        metrics_port = os.getenv('METRICS_PORT')
+        if metrics_port:
+            await start_metrics_server(int(metrics_port))
+
+        # Start polling
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO)
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1,62 +1,186 @@
+import asyncio
 import logging
 import hashlib
 import os
-from datetime import datetime, timedelta
-from collections import defaultdict
+import time
+from datetime import timedelta
+from collections import deque
 from functools import wraps
 from typing import Union
 from aiogram.types import Message, CallbackQuery
 from aiogram.types import ReplyKeyboardRemove
 from app.database import requests as rq
+from app.database.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class UserAttempts:
+    __slots__ = ('timestamps', 'violations')
+
+    def __init__(self, max_attempts: int):
+        # Ring buffer of monotonic timestamps, the oldest one drops out on append
+        self.timestamps = deque(maxlen=max_attempts)
+        self.violations = 0
 
 
 class RateLimiter:
-    def __init__(self):
-        self.attempts = defaultdict(list)
-        self.rate_limit_violations = defaultdict(int)
-
-    def _clean_old_attemps(self, user_id: int, window: timedelta):
-        """Remove attempts older than window"""
-        current_time = datetime.now()
-        self.attempts[user_id] = [
-            attempt_time
-            for attempt_time in self.attempts[user_id]
-            if current_time - attempt_time < window
-        ]
+    def __init__(self, idle_ttl: timedelta = timedelta(hours=1), sweep_interval: float = 300):
+        self.users = {}
+        self.idle_ttl = idle_ttl.total_seconds()
+        self.sweep_interval = sweep_interval
+        self._evictor = None
+
+    def _get_user(self, user_id: int, max_attempts: int = None) -> UserAttempts:
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = UserAttempts(max_attempts or 5)
+        elif max_attempts and user.timestamps.maxlen != max_attempts:
+            user.timestamps = deque(user.timestamps, maxlen=max_attempts)
+        return user
 
     def is_rate_limited(self, user_id: int, max_attempts: int, window: timedelta):
-        """Check if user is rate limited"""
-        self._clean_old_attemps(user_id, window)
-        return len(self.attempts[user_id]) >= max_attempts
+        """Check if user made max_attempts attempts within window"""
+        user = self.users.get(user_id)
+        if user is None or len(user.timestamps) < max_attempts:
+            return False
+        return time.monotonic() - user.timestamps[0] < window.total_seconds()
 
-    def add_attempt(self, user_id: int):
+    def add_attempt(self, user_id: int, max_attempts: int = 5):
         """Record new attempt"""
-        self.attempts[user_id].append(datetime.now())
+        self._get_user(user_id, max_attempts).timestamps.append(time.monotonic())
+        self._start_evictor()
+
+    def retry_after(self, user_id: int, window: timedelta) -> timedelta:
+        """Time until the oldest attempt in the window expires"""
+        user = self.users.get(user_id)
+        if user is None or not user.timestamps:
+            return timedelta()
+        return window - timedelta(seconds=time.monotonic() - user.timestamps[0])
+
+    def violations(self, user_id: int) -> int:
+        user = self.users.get(user_id)
+        return user.violations if user else 0
 
     async def check_and_ban_if_needed(self, user_id: int) -> bool:
         """Check if user should be banned based on repeated violations"""
         if await rq.is_admin(user_id):
             return False
 
-        self.rate_limit_violations[user_id] += 1
-        print(f"User {user_id} violations: {self.rate_limit_violations[user_id]}")
+        user = self._get_user(user_id)
+        user.violations += 1
+        logger.info("User %s violations: %s", user_id, user.violations)
 
-        if self.rate_limit_violations[user_id] >= 2:
+        if user.violations >= 2:
             await rq.add_banned_user(
                 user_id,
-                f"Rate limit exceeded {self.rate_limit_violations[user_id]} times"
+                f"Rate limit exceeded {user.violations} times"
             )
             return True
         return False
 
     def reset_violations(self, user_id: int):
         """Reset violation count for user"""
-        if user_id in self.rate_limit_violations:
-            del self.rate_limit_violations[user_id]
+        user = self.users.get(user_id)
+        if user is not None:
+            user.violations = 0
+
+    def evict_idle(self) -> int:
+        """Drop users whose last attempt is older than idle_ttl"""
+        cutoff = time.monotonic() - self.idle_ttl
+        idle = [
+            user_id for user_id, user in self.users.items()
+            if not user.timestamps or user.timestamps[-1] < cutoff
+        ]
+        for user_id in idle:
+            del self.users[user_id]
+        return len(idle)
+
+    def _start_evictor(self):
+        if self._evictor is None or self._evictor.done():
+            self._evictor = asyncio.get_running_loop().create_task(self._evict_loop())
+
+    async def _evict_loop(self):
+        while self.users:
+            await asyncio.sleep(self.sweep_interval)
+            evicted = self.evict_idle()
+            if evicted:
+                logger.info("Evicted %s idle users from rate limiter", evicted)
+
+
+class SharedRateLimiter:
+    """Token bucket per user kept in the database, shared by all bot processes.
+
+    Users the local limiter already rejects or that were recently denied by
+    the shared bucket are answered in-process, so floods don't turn into
+    database round trips. Allowed attempts are leased `lease` tokens at a
+    time and the spares spent in-process, so only every lease-th attempt
+    costs a round trip; unspent spares are lost, which errs on the strict side.
+    """
+
+    def __init__(self, purge_interval: float = 3600, lease: int = 2):
+        self.denied_until = TTLCache(maxsize=10000, ttl=purge_interval)
+        self.leased = TTLCache(maxsize=10000, ttl=purge_interval)  # user_id -> [spare tokens]
+        self.lease = lease
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self._purge_task = None
+
+    async def check(self, user_id: int, max_attempts: int, window: timedelta):
+        """Take a token for user_id; returns the time left when limited, else None"""
+        now = time.monotonic()
+        deadline = self.denied_until.get(user_id)
+        if deadline is not None and deadline > now:
+            return timedelta(seconds=deadline - now)
+
+        spare = self.leased.get(user_id)
+        if spare and spare[0] > 0:
+            spare[0] -= 1
+            return None
+
+        # Same limit as RateLimiter, which turns away the max_attempts-th attempt in a window
+        allowed = max(max_attempts - 1, 1)
+        refill_rate = allowed / window.total_seconds()
+        self._purge_if_due(window)
+
+        lease = min(self.lease, allowed)
+        if lease > 1 and await rq.take_rate_limit_tokens(f"auth:{user_id}", allowed, refill_rate, lease):
+            self.leased.set(user_id, [lease - 1])
+            return None
+
+        # Fewer tokens left than a lease: take them one at a time
+        tokens = await rq.take_rate_limit_token(f"auth:{user_id}", allowed, refill_rate)
+
+        if tokens >= 0:
+            return None
+
+        wait = (1 - tokens) / refill_rate
+        self.denied_until.set(user_id, now + wait)
+        return timedelta(seconds=wait)
+
+    def _purge_if_due(self, window: timedelta):
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = time.monotonic()
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self._purge(window.total_seconds()))
+
+    async def _purge(self, idle_seconds: float):
+        try:
+            purged = await rq.purge_rate_limit_buckets(idle_seconds)
+            logger.debug("Purged %s idle rate limit buckets", purged)
+        except Exception:
+            logger.exception("Purging rate limit buckets failed")
 
 
 rate_limiter = RateLimiter()
 
+# RATE_LIMIT_BACKEND=database enforces max_attempts across all bot processes
+shared_rate_limiter = (
+    SharedRateLimiter(lease=int(os.getenv('RATE_LIMIT_LEASE', 2)))
+    if os.getenv('RATE_LIMIT_BACKEND', 'local').lower() == 'database' else None
+)
+
 
 def rate_limit(max_attempts: int = 5, window: timedelta = timedelta(minutes=15)):
     def decorator(func):
@@ -64,34 +188,39 @@ def rate_limit(max_attempts: int = 5, window: timedelta = timedelta(minutes=15))
         async def wrapper(message, *args, **kwargs):
             user_id = message.from_user.id
 
-            banned = await rq.get_banned_users(user_id)
-            if banned:
+            if rq.is_banned(user_id):
                 await message.answer(
                     "❌ You have been banned from using this bot due to multiple violations."
                 )
                 return
 
-            rate_limiter.add_attempt(user_id)
+            rate_limiter.add_attempt(user_id, max_attempts)
+
+            # Local limiter first; authorized users never reach the shared bucket
+            time_left = None
+            if rate_limiter.is_rate_limited(user_id, max_attempts, window):
+                time_left = rate_limiter.retry_after(user_id, window)
+            elif shared_rate_limiter is not None and not rq.auth_cache.get(user_id):
+                time_left = await shared_rate_limiter.check(user_id, max_attempts, window)
 
-            if rate_limiter.is_rate_limited(user_id, max_attempts, window): # If is_rate_limited is True
+            if time_left is not None:
                 should_ban = await rate_limiter.check_and_ban_if_needed(user_id)
 
                 if should_ban:
                     await message.answer(
                         "❌ You have been banned from using this bot due to multiple rate limit violations."
                     )
-                    logging.warning(f"User {user_id} has been banned due to multiple violations")
+                    logger.warning("User %s has been banned due to multiple violations", user_id)
                     return
 
-                time_left = window - (datetime.now() - rate_limiter.attempts[user_id][0])
                 minutes_left = int(time_left.total_seconds() // 60)
 
                 await message.answer(
                     f"⚠️ Too many attempts. Please try again in {minutes_left} minutes.\n"
                     f"Warning: Multiple violations will result in a ban.\n"
-                    f"Violations: {rate_limiter.rate_limit_violations[user_id]}/2"
+                    f"Violations: {rate_limiter.violations(user_id)}/2"
                 )
-                logging.warning(f"Rate limit exceeded for user {user_id}")
+                logger.warning("Rate limit exceeded for user %s", user_id)
                 return
 
             try:
@@ -100,7 +229,7 @@ def rate_limit(max_attempts: int = 5, window: timedelta = timedelta(minutes=15))
                     rate_limiter.reset_violations(user_id)
                 return result
             except Exception as e:
-                logging.error(f"Error in rate-limited function: {e}")
+                logger.error("Error in rate-limited function: %s", e)
                 raise
 
         return wrapper
@@ -135,6 +264,5 @@ def auth_required(func):
 
 async def check_password(user_input):
     hashed_input = hashlib.sha256(user_input.encode()).hexdigest()
-    print(f"Hashed input: {hashed_input}")
     stored_hash = os.getenv("BOT_PASSWORD")
     return hashed_input == stored_hash
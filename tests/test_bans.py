@@ -0,0 +1,30 @@
+import asyncio
+
+from sqlalchemy import delete, insert
+
+from app.database import models, requests as rq
+from app.database.migrations import upgrade
+
+
+def test_reload_picks_up_bans_and_unbans_from_other_processes():
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        try:
+            await upgrade()
+            await rq.load_banned_users()
+            await rq.add_banned_user(1)
+
+            # Another process unbans user 1 and bans user 2
+            async with models.async_session() as session:
+                async with session.begin():
+                    await session.execute(delete(models.BannedUser).where(models.BannedUser.tg_id == 1))
+                    await session.execute(insert(models.BannedUser).values(tg_id=2, reason='test'))
+            before = rq.is_banned(1), rq.is_banned(2)
+
+            await rq.load_banned_users()
+            return before, (rq.is_banned(1), rq.is_banned(2))
+        finally:
+            rq.banned_ids.clear()
+            await models.dispose_engine()
+
+    assert asyncio.run(run()) == ((True, False), (False, True))
@@ -0,0 +1,14 @@
+import pytest
+
+from app.callbacks import CallbackDataError, ConfirmLoan, unpack
+
+
+def test_bool_fields_round_trip():
+    assert unpack(ConfirmLoan(True).pack()) == ConfirmLoan(True)
+    assert unpack(ConfirmLoan(False).pack()) == ConfirmLoan(False)
+
+
+@pytest.mark.parametrize('raw', ['2', 'x', ''])
+def test_malformed_bool_is_rejected(raw):
+    with pytest.raises(CallbackDataError):
+        unpack(f"1|c|{raw}")
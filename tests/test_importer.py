@@ -0,0 +1,69 @@
+import asyncio
+import io
+
+import pytest
+
+from app.database import models, requests as rq
+from app.database.migrations import upgrade
+from app.importer import import_loans, iter_records, parse_record
+
+
+@pytest.mark.parametrize('field, value', [
+    ('total_amount', 'nan'),
+    ('total_amount', 'inf'),
+    ('payment_amount', 'nan'),
+    ('remaining_amount', '-inf'),
+    ('remaining_amount', '-1'),
+])
+def test_parse_record_rejects_bad_amounts(field, value):
+    raw = {'name': 'Bob', 'total_amount': '100', 'payment_frequency': 'weekly', 'number_of_payments': '4'}
+    raw[field] = value
+    with pytest.raises(ValueError, match=field):
+        parse_record(raw)
+
+
+def test_bad_amounts_are_skipped_without_losing_the_batch():
+    data = (
+        "name,total_amount,payment_frequency,number_of_payments\n"
+        "Alice,100,weekly,4\n"
+        "Bob,nan,weekly,3\n"
+        "Carol,60,monthly,2\n"
+    )
+
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        try:
+            await upgrade()
+            stats = await import_loans(iter_records(io.StringIO(data)))
+            return stats, await rq.get_all_loans()
+        finally:
+            await models.dispose_engine()
+
+    stats, loans = asyncio.run(run())
+    assert (stats['loans'], stats['skipped']) == (2, 1)
+    assert sorted(loan['person_name'] for loan in loans) == ['Alice', 'Carol']
+
+
+def test_imported_loans_reach_loan_listeners():
+    data = (
+        "name,total_amount,payment_frequency,number_of_payments,remaining_amount\n"
+        "Alice,100,weekly,4,50\n"
+        "Carol,60,monthly,2,\n"
+    )
+    changes = []
+
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        rq.loan_listeners.append(changes.append)
+        try:
+            await upgrade()
+            await import_loans(iter_records(io.StringIO(data)), batch_size=1)
+            return await rq.get_all_loans()
+        finally:
+            rq.loan_listeners.remove(changes.append)
+            await models.dispose_engine()
+
+    loans = asyncio.run(run())
+    assert sorted(change['id'] for change in changes) == sorted(loan['id'] for loan in loans)
+    assert [(change['remaining_amount'], change['frequency']) for change in changes] == [(50, 'weekly'), (60, 'monthly')]
+    assert all(change['status'] == 'active' and change['created_at'] for change in changes)
@@ -0,0 +1,50 @@
+import asyncio
+
+from app.database import models, requests as rq
+from app.database.migrations import upgrade
+
+
+async def _create_and_update_loan(changes):
+    models.configure('sqlite+aiosqlite:///:memory:')
+    rq.loan_listeners.append(changes.append)
+    try:
+        await upgrade()
+        person = await rq.create_person('Alice')
+        loan = await rq.create_loan(person['id'], 100, 'weekly', 5, 20)
+        updated = await rq.update_loan_payment_details(loan['id'], 3)
+        adjusted = await rq.adjust_loan_payments(loan['id'], -3)
+        return loan, updated, adjusted
+    finally:
+        rq.loan_listeners.remove(changes.append)
+        await models.dispose_engine()
+
+
+def test_listeners_see_committed_loan_changes():
+    changes = []
+    loan, updated, adjusted = asyncio.run(_create_and_update_loan(changes))
+
+    assert updated is True
+    assert adjusted['status'] == 'completed'
+    assert [change['id'] for change in changes] == [loan['id']] * 3
+    assert [change['remaining_amount'] for change in changes] == [100, 60, 0]
+    assert [change['status'] for change in changes] == ['active', 'active', 'completed']
+    assert all(change['frequency'] == 'weekly' and change['created_at'] for change in changes)
+
+
+def test_failing_listener_does_not_fail_the_write():
+    def broken(fields):
+        raise RuntimeError("listener bug")
+
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        rq.loan_listeners.append(broken)
+        try:
+            await upgrade()
+            person = await rq.create_person('Bob')
+            loan = await rq.create_loan(person['id'], 50, 'monthly', 2, 25)
+            return await rq.get_loan_details(loan['id'])
+        finally:
+            rq.loan_listeners.remove(broken)
+            await models.dispose_engine()
+
+    assert asyncio.run(run())['remaining_amount'] == 50
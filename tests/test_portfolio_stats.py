@@ -0,0 +1,31 @@
+import asyncio
+
+from app.database import models, requests as rq
+from app.database.migrations import upgrade
+
+
+def test_snapshot_computed_across_a_loan_change_is_not_cached():
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        try:
+            await upgrade()
+            person = await rq.create_person('Alice')
+            await rq.create_loan(person['id'], 100, 'weekly', 5, 20)
+
+            # The change commits while the aggregate queries are running
+            stats = asyncio.create_task(rq.get_portfolio_stats())
+            await asyncio.sleep(0)
+            rq.invalidate_stats()
+            await stats
+            stale_cached = rq.stats_cache.get('portfolio')
+
+            fresh = await rq.get_portfolio_stats()
+            return stale_cached, fresh, rq.stats_cache.get('portfolio')
+        finally:
+            rq.invalidate_stats()
+            await models.dispose_engine()
+
+    stale_cached, fresh, cached = asyncio.run(run())
+    assert stale_cached is None
+    assert fresh['outstanding'] == 100
+    assert cached is fresh
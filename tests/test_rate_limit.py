@@ -0,0 +1,31 @@
+import asyncio
+from datetime import timedelta
+
+from app.database import models, requests as rq
+from app.database.migrations import upgrade
+from security import SharedRateLimiter
+
+
+def test_shared_limiter_leases_tokens_and_denies_the_fifth_attempt(monkeypatch):
+    calls = []
+    for name in ('take_rate_limit_token', 'take_rate_limit_tokens'):
+        def counted(*args, _take=getattr(rq, name), _name=name):
+            calls.append(_name)
+            return _take(*args)
+        monkeypatch.setattr(rq, name, counted)
+
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        try:
+            await upgrade()
+            limiter = SharedRateLimiter(lease=2)
+            # A second process shares the database bucket but not the leases
+            other = SharedRateLimiter(lease=2)
+            results = [await limiter.check(1, 5, timedelta(minutes=15)) is None for _ in range(4)]
+            results.append(await other.check(1, 5, timedelta(minutes=15)) is None)
+            return results
+        finally:
+            await models.dispose_engine()
+
+    assert asyncio.run(run()) == [True, True, True, True, False]
+    assert calls == ['take_rate_limit_tokens', 'take_rate_limit_tokens', 'take_rate_limit_tokens', 'take_rate_limit_token']
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from app.database import models
+from app.database.migrations import upgrade
+from app.storage.buffered import BufferedStorage
+from app.storage.sql import SQLStorage
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+
+async def _round_trip(backend):
+    storage = BufferedStorage(backend, flush_interval=0.01)
+    await storage.set_state(KEY, 'NewLoan:name')
+    await storage.set_data(KEY, {'name': 'Alice'})
+    await storage.set_state(OTHER_KEY, 'Search:query')
+    await storage.flush()
+
+    # A fresh buffer has nothing pending, so these come from the backend
+    reader = BufferedStorage(backend)
+    result = (
+        await reader.get_state(KEY), await reader.get_data(KEY),
+        await reader.get_state(OTHER_KEY), await reader.get_data(OTHER_KEY)
+    )
+
+    await storage.set_state(KEY, None)
+    await storage.set_data(KEY, {})
+    await storage.flush()
+    return result + (await reader.get_state(KEY), await reader.get_data(KEY))
+
+
+def _sql(ttl):
+    models.configure('sqlite+aiosqlite:///:memory:')
+    return SQLStorage(ttl=ttl)
+
+
+def _redis(ttl):
+    # The redis backend is optional; fakeredis stands in for a server
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('redis')
+    from app.storage.redis_storage import PipelinedRedisStorage
+    return PipelinedRedisStorage(fakeredis.FakeAsyncRedis(), state_ttl=ttl, data_ttl=ttl)
+
+
+def test_sql_storage_round_trip():
+    async def run():
+        backend = _sql(ttl=60)
+        try:
+            await upgrade()
+            return await _round_trip(backend)
+        finally:
+            await models.dispose_engine()
+
+    assert asyncio.run(run()) == ('NewLoan:name', {'name': 'Alice'}, 'Search:query', {}, None, {})
+
+
+def test_redis_storage_round_trip():
+    assert asyncio.run(_round_trip(_redis(ttl=60))) == (
+        'NewLoan:name', {'name': 'Alice'}, 'Search:query', {}, None, {}
+    )
+
+
+async def _expire(backend, wait):
+    storage = BufferedStorage(backend)
+    await storage.set_state(KEY, 'NewLoan:name')
+    await storage.set_data(KEY, {'name': 'Alice'})
+    await storage.flush()
+    before = await storage.get_state(KEY), await storage.get_data(KEY)
+    await asyncio.sleep(wait)
+    return before + (await storage.get_state(KEY), await storage.get_data(KEY))
+
+
+def test_sql_storage_expires_records():
+    async def run():
+        backend = _sql(ttl=0.2)
+        try:
+            await upgrade()
+            return await _expire(backend, 0.3)
+        finally:
+            await models.dispose_engine()
+
+    assert asyncio.run(run()) == ('NewLoan:name', {'name': 'Alice'}, None, {})
+
+
+def test_redis_storage_expires_records():
+    assert asyncio.run(_expire(_redis(ttl=1), 1.1)) == ('NewLoan:name', {'name': 'Alice'}, None, {})
+
+
+class SlowStorage(SQLStorage):
+    """SQLStorage whose writes block until released, to read during a flush"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def write_many(self, records):
+        await self.release.wait()
+        await super().write_many(records)
+
+
+def test_reads_during_flush_see_in_flight_writes():
+    async def run():
+        models.configure('sqlite+aiosqlite:///:memory:')
+        try:
+            await upgrade()
+            backend = SlowStorage()
+            storage = BufferedStorage(backend)
+            await storage.set_state(KEY, 'NewLoan:amount')
+            await storage.set_data(KEY, {'name': 'Alice'})
+
+            flush = asyncio.create_task(storage.flush())
+            await asyncio.sleep(0)
+            during = await storage.get_state(KEY), await storage.get_data(KEY)
+            backend.release.set()
+            await flush
+            return during + (await backend.get_state(KEY),)
+        finally:
+            await models.dispose_engine()
+
+    assert asyncio.run(run()) == ('NewLoan:amount', {'name': 'Alice'}, 'NewLoan:amount')